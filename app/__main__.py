@@ -0,0 +1,31 @@
+"""
+Server entry point (python -m app).
+
+Kept out of app.main: worker processes started with spawn or forkserver
+re-import the main module unless it is a package __main__, and app.main
+pulls in the models and services.
+"""
+from dotenv import load_dotenv
+import sys
+
+# Load environment variables from .env file
+load_dotenv()
+
+from app.config import LOG_LEVEL, SERVER_WORKERS, DEV_RELOAD
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(
+        "app.main:app",
+        host="0.0.0.0",
+        port=8000,
+        # uvloop is not available on Windows
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
+        # Each worker loads its own copy of the embedding model; prefer 1
+        workers=SERVER_WORKERS,
+        reload=DEV_RELOAD,
+        log_level=LOG_LEVEL.lower()
+    )
@@ -2,6 +2,7 @@
 App configuration and constants.
 """
 import os
+import re
 from pathlib import Path
 
 # Base paths
@@ -9,18 +10,47 @@ BASE_DIR = Path(__file__).parent.parent
 STORAGE_DIR = BASE_DIR / "storage"
 DOCS_DIR = STORAGE_DIR / "docs"
 CHROMA_DB_DIR = STORAGE_DIR / "chroma_db"
+CHUNK_CACHE_DIR = STORAGE_DIR / "chunk_cache"
 
 DOCS_DIR.mkdir(parents=True, exist_ok=True)
 CHROMA_DB_DIR.mkdir(parents=True, exist_ok=True)
 
 # Database settings
-DATABASE_URL = f"sqlite:///{BASE_DIR}/policy_chatbot.db"
+DATABASE_PATH = BASE_DIR / "policy_chatbot.db"
+DATABASE_URL = f"sqlite:///{DATABASE_PATH}"
+# Read-only URI connection used for pure SELECT endpoints
+READ_DATABASE_URL = f"sqlite:///file:{DATABASE_PATH}?mode=ro&uri=true"
 
 # ChromaDB settings
 CHROMA_COLLECTION_NAME = "policy_documents"
+CHROMA_SQLITE_FILENAME = "chroma.sqlite3"  # chromadb's metadata store inside CHROMA_DB_DIR
+CHROMA_UPSERT_BATCH = 200  # Chunks per upsert call
+CHROMA_UPSERT_CONCURRENCY = 4  # Parallel upsert calls per document
+# Embeddings are stored as float32. chromadb 0.4.x has no int8 vector type,
+# and calibrated int8 quantization (sentence_transformers quantize_embeddings)
+# derives per-batch ranges that a single query embedding cannot reproduce,
+# so quantized document and query vectors would not be comparable.
+# HNSW index parameters (applied when the collection is first created)
+CHROMA_HNSW_METADATA = {
+    "hnsw:space": "cosine",
+    "hnsw:M": 32,
+    "hnsw:construction_ef": 200,
+    "hnsw:search_ef": 64,
+}
 
 # Embedding model
 EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_GPU_BATCH_SIZE = int(os.getenv("EMBEDDING_GPU_BATCH_SIZE", "128"))
+# "auto" = fp16 on CUDA, fp32 on CPU; "fp16", "bf16" or "fp32" to force
+EMBEDDING_PRECISION = os.getenv("EMBEDDING_PRECISION", "auto").lower()
+
+# PDF extraction settings (pages are extracted in worker processes for larger PDFs)
+# "auto" = PyMuPDF when installed, else pdfplumber; "pymupdf" or "pdfplumber" to force
+PDF_BACKEND = os.getenv("PDF_BACKEND", "auto").lower()
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(min(os.cpu_count() or 1, 8))))
+PDF_PARALLEL_MIN_PAGES = 4  # Smaller PDFs aren't worth the IPC round trip
+PDF_PAGES_PER_TASK = 4  # Pages per worker task; each task opens the PDF once
 
 # Chunking settings
 CHUNK_SIZE = 900  # Target chunk size in characters
@@ -29,22 +59,47 @@ SEPARATORS = ["\n\n", "\n", " "]  # Priority order for splitting
 
 # Section heading detection regex
 SECTION_HEADING_PATTERN = r"^\d+\.\s+.*"
+SECTION_HEADING_RE = re.compile(SECTION_HEADING_PATTERN)
+
+# Reuse chunks and embeddings for files whose content was ingested before.
+# Off by default: entries are never evicted, nor removed when a document is deleted.
+CHUNK_CACHE_ENABLED = os.getenv("CHUNK_CACHE", "false").lower() == "true"
+if CHUNK_CACHE_ENABLED:
+    CHUNK_CACHE_DIR.mkdir(parents=True, exist_ok=True)
 
 # RAG settings
 RETRIEVAL_TOP_K = 4  # Number of chunks to retrieve
 CONVERSATION_HISTORY_LENGTH = 5  # Number of messages to include in context
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024"))  # 0 disables
+# Concurrent retrievals arriving within this window share one ChromaDB query (0 disables)
+QUERY_BATCH_WINDOW_MS = float(os.getenv("QUERY_BATCH_WINDOW_MS", "10"))
+QUERY_BATCH_MAX_SIZE = int(os.getenv("QUERY_BATCH_MAX_SIZE", "16"))
+QUERY_BATCH_TIMEOUT_S = float(os.getenv("QUERY_BATCH_TIMEOUT_S", "30"))  # Max wait for a batched query
 
 # Logging settings
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 LOG_FORMAT = "%(asctime)s | %(levelname)s | %(name)s | %(message)s"
 LOG_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 
+# Server settings (used when running `python -m app`)
+SERVER_WORKERS = int(os.getenv("WORKERS", "1"))  # Each worker loads its own models
+DEV_RELOAD = os.getenv("DEV") == "1"
+
+# CORS settings (comma-separated list of allowed origins)
+CORS_ORIGINS = [
+    origin.strip()
+    for origin in os.getenv("CORS_ORIGINS", "http://localhost:3000").split(",")
+    if origin.strip()
+]
+
 # File upload settings
-ALLOWED_EXTENSIONS = {".pdf", ".txt"}
+ALLOWED_EXTENSIONS = frozenset({".pdf", ".txt"})
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1MB read/write block for streamed uploads
 
 # OpenAI Configuration
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 OPENAI_TEMPERATURE = float(os.getenv("OPENAI_TEMPERATURE", "0.7"))
 OPENAI_MAX_TOKENS = int(os.getenv("OPENAI_MAX_TOKENS", "1000"))
+OPENAI_WARMUP = os.getenv("OPENAI_WARMUP", "true").lower() == "true"  # 1-token call at startup
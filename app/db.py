@@ -2,23 +2,97 @@
 Database setup and session management.
 """
 from sqlmodel import SQLModel, create_engine, Session
-from app.config import DATABASE_URL
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+from app.config import DATABASE_URL, READ_DATABASE_URL
 import logging
 
 logger = logging.getLogger(__name__)
 
-# Create engine
+# SQLite pragmas applied to every new connection.
+SQLITE_READ_PRAGMAS = (
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",  # 256MB
+    "PRAGMA busy_timeout=5000",  # ms
+    "PRAGMA cache_size=-65536",  # 64MB
+)
+# WAL lets readers proceed while a writer is active; NORMAL sync is safe under WAL.
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+) + SQLITE_READ_PRAGMAS
+
+# Create engine (all writes go through this one)
 engine = create_engine(
     DATABASE_URL,
     connect_args={"check_same_thread": False},
+    pool_size=10,
+    max_overflow=20,
+    echo=False
+)
+
+# Read-only engine so SELECT-only endpoints don't compete for writer connections
+read_engine = create_engine(
+    READ_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    pool_size=20,
+    max_overflow=40,
     echo=False
 )
 
 
+def _apply_pragmas(dbapi_connection, pragmas) -> None:
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in pragmas:
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
+
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """Apply SQLite performance pragmas on connect."""
+    _apply_pragmas(dbapi_connection, SQLITE_PRAGMAS)
+
+
+@event.listens_for(read_engine, "connect")
+def _set_sqlite_read_pragmas(dbapi_connection, connection_record) -> None:
+    """Apply SQLite pragmas that are valid on read-only connections."""
+    _apply_pragmas(dbapi_connection, SQLITE_READ_PRAGMAS)
+
+
+# Session factory: callers control flushes and transaction boundaries explicitly
+SessionLocal = sessionmaker(
+    bind=engine,
+    class_=Session,
+    autoflush=False,
+    expire_on_commit=False
+)
+ReadSessionLocal = sessionmaker(
+    bind=read_engine,
+    class_=Session,
+    autoflush=False,
+    expire_on_commit=False
+)
+
+
+# Single-column indexes covered by the leading column of a composite index
+_SUPERSEDED_INDEXES = ("ix_chunks_document_id", "ix_messages_conversation_id")
+
+
 def init_db() -> None:
-    """Create all database tables."""
+    """Create all database tables and any missing indexes."""
     try:
         SQLModel.metadata.create_all(engine)
+        # create_all skips existing tables, so add indexes introduced later
+        for table in SQLModel.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=engine, checkfirst=True)
+        # ...and drop the ones they replaced, which only slow down writes
+        with engine.begin() as conn:
+            for name in _SUPERSEDED_INDEXES:
+                conn.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
         logger.info("Database initialized successfully")
     except Exception as e:
         logger.error(f"Failed to initialize database: {e}")
@@ -27,5 +101,11 @@ def init_db() -> None:
 
 def get_session():
     """Yield a database session."""
-    with Session(engine) as session:
+    with SessionLocal() as session:
+        yield session
+
+
+def get_read_session():
+    """Yield a read-only database session."""
+    with ReadSessionLocal() as session:
         yield session
@@ -0,0 +1,17 @@
+"""
+FastAPI dependencies for services preloaded at startup.
+"""
+from fastapi import Request
+
+from app.services.document_service import DocumentService
+from app.services.rag_service import RAGService
+
+
+def get_document_service_dep(request: Request) -> DocumentService:
+    """Return the DocumentService stored on app.state during lifespan."""
+    return request.app.state.document_service
+
+
+def get_rag_service_dep(request: Request) -> RAGService:
+    """Return the RAGService stored on app.state during lifespan."""
+    return request.app.state.rag_service
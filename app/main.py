@@ -2,16 +2,23 @@
 FastAPI main app for RAG chatbot.
 """
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
+import asyncio
 import logging
 import sys
 
 # Load environment variables from .env file
 load_dotenv()
 
-from app.config import LOG_LEVEL, LOG_FORMAT, LOG_DATE_FORMAT
+from app.config import (
+    LOG_LEVEL,
+    LOG_FORMAT,
+    LOG_DATE_FORMAT,
+    CORS_ORIGINS
+)
 from app.db import init_db
 from app.routers import docs_router, chat_router, health_router
 
@@ -69,20 +76,32 @@ async def lifespan(app: FastAPI):
     logger.info("=" * 70)
     
     try:
-        # Initialize database
-        logger.info("Initializing database...")
-        init_db()
-        
-        # Pre-load services (triggers model loading)
-        logger.info("Pre-loading services...")
+        # Initialize database and pre-load services (triggers model loading).
+        # Run in worker threads so model loading, ChromaDB startup and schema
+        # creation overlap instead of running back to back.
+        logger.info("Initializing database and pre-loading services...")
         from app.services.llm_service import get_llm_service
         from app.services.document_service import get_document_service
         from app.services.rag_service import get_rag_service
         
-        # Initialize services
-        get_llm_service()
-        get_document_service()
-        get_rag_service()
+        llm_service, document_service, rag_service, _ = await asyncio.gather(
+            asyncio.to_thread(get_llm_service),
+            asyncio.to_thread(get_document_service),
+            asyncio.to_thread(get_rag_service),
+            asyncio.to_thread(init_db)
+        )
+        
+        # Keep services on app.state for injection
+        app.state.llm_service = llm_service
+        app.state.document_service = document_service
+        app.state.rag_service = rag_service
+        
+        # Warm up models before serving traffic
+        logger.info("Warming up models...")
+        await asyncio.gather(
+            asyncio.to_thread(llm_service.warmup),
+            llm_service.warmup_openai()
+        )
         
         logger.info("All services initialized successfully")
         logger.info("Application startup complete")
@@ -99,6 +118,9 @@ async def lifespan(app: FastAPI):
         logger.info("=" * 70)
         logger.info("Shutting down application")
         logger.info("=" * 70)
+        llm_service = getattr(app.state, "llm_service", None)
+        if llm_service and llm_service.openai_client:
+            await llm_service.openai_client.close()
 
 
 # Create FastAPI application
@@ -106,16 +128,18 @@ app = FastAPI(
     title="Company Policy Chatbot",
     description="RAG-based chatbot for company policy documents using FastAPI, ChromaDB, and sentence-transformers",
     version="1.0.0",
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],  # Configure appropriately for production
+    allow_origins=CORS_ORIGINS,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST", "DELETE"],
+    allow_headers=["Content-Type"],
+    max_age=86400,  # Let browsers cache preflight responses for a day
 )
 
 # Include routers
@@ -144,15 +168,3 @@ async def root():
         }
     }
 
-
-if __name__ == "__main__":
-    import uvicorn
-    
-    logger.info("Starting server with uvicorn")
-    uvicorn.run(
-        "app.main:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=True,
-        log_level=LOG_LEVEL.lower()
-    )
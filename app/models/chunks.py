@@ -2,6 +2,7 @@
 Chunk model for storing document chunks with metadata.
 """
 from sqlmodel import SQLModel, Field
+from sqlalchemy import Index
 from typing import Optional
 
 
@@ -19,9 +20,13 @@ class Chunk(SQLModel, table=True):
         section_title: Section heading this chunk belongs to
     """
     __tablename__ = "chunks"
+    __table_args__ = (
+        # Covers listing a document's chunk IDs without touching the table
+        Index("ix_chunks_doc_chunk", "document_id", "chunk_id"),
+    )
     
     id: Optional[int] = Field(default=None, primary_key=True)
-    document_id: int = Field(foreign_key="documents.id", index=True)
+    document_id: int = Field(foreign_key="documents.id")
     chunk_id: str = Field(unique=True, index=True)
     content: str
     start_line: int
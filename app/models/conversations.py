@@ -2,6 +2,7 @@
 Conversation model for tracking chat sessions.
 """
 from sqlmodel import SQLModel, Field
+from sqlalchemy import Column, DateTime, Index, func
 from datetime import datetime
 from typing import Optional
 
@@ -17,8 +18,29 @@ class Conversation(SQLModel, table=True):
         updated_at: Last message timestamp
     """
     __tablename__ = "conversations"
+    __table_args__ = (
+        # Lets "most recent conversations" stop after LIMIT rows without a sort
+        Index("ix_conversations_updated_at", "updated_at"),
+    )
     
     id: Optional[int] = Field(default=None, primary_key=True)
     title: Optional[str] = Field(default=None, max_length=200)
-    created_at: datetime = Field(default_factory=datetime.utcnow)
-    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: Optional[datetime] = Field(
+        default=None,
+        sa_column=Column(
+            DateTime,
+            default=func.now(),
+            server_default=func.now(),
+            nullable=False
+        )
+    )
+    updated_at: Optional[datetime] = Field(
+        default=None,
+        sa_column=Column(
+            DateTime,
+            default=func.now(),
+            server_default=func.now(),
+            onupdate=func.now(),
+            nullable=False
+        )
+    )
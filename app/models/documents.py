@@ -2,6 +2,7 @@
 Document model for storing uploaded policy documents.
 """
 from sqlmodel import SQLModel, Field
+from sqlalchemy import Column, DateTime, func
 from datetime import datetime
 from typing import Optional
 
@@ -21,4 +22,12 @@ class Document(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str = Field(index=True)
     path: str
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: Optional[datetime] = Field(
+        default=None,
+        sa_column=Column(
+            DateTime,
+            default=func.now(),
+            server_default=func.now(),
+            nullable=False
+        )
+    )
@@ -2,8 +2,9 @@
 Message model for storing conversation messages.
 """
 from sqlmodel import SQLModel, Field
+from sqlalchemy import CheckConstraint, Column, DateTime, Index, String, func
 from datetime import datetime
-from typing import Optional
+from typing import Literal, Optional
 
 
 class Message(SQLModel, table=True):
@@ -18,9 +19,22 @@ class Message(SQLModel, table=True):
         created_at: Message timestamp
     """
     __tablename__ = "messages"
+    __table_args__ = (
+        # Serves "latest N messages of a conversation" from index order
+        Index("ix_messages_conv_created", "conversation_id", "created_at"),
+        CheckConstraint("role IN ('user', 'assistant')", name="ck_messages_role"),
+    )
     
     id: Optional[int] = Field(default=None, primary_key=True)
-    conversation_id: int = Field(foreign_key="conversations.id", index=True)
-    role: str = Field(regex="^(user|assistant)$")
+    conversation_id: int = Field(foreign_key="conversations.id")
+    role: Literal["user", "assistant"] = Field(sa_column=Column(String, nullable=False))
     content: str
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: Optional[datetime] = Field(
+        default=None,
+        sa_column=Column(
+            DateTime,
+            default=func.now(),
+            server_default=func.now(),
+            nullable=False
+        )
+    )
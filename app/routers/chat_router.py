@@ -3,12 +3,14 @@ Chat router for RAG queries.
 """
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlmodel import Session
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Optional, List, Dict, Any
+import asyncio
 import logging
 
-from app.db import get_session
-from app.services.rag_service import get_rag_service
+from app.db import get_session, get_read_session
+from app.dependencies import get_rag_service_dep
+from app.services.rag_service import RAGService
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +26,8 @@ class ChatRequest(BaseModel):
 
 class Citation(BaseModel):
     """Citation for source reference."""
+    model_config = ConfigDict(from_attributes=True)
+    
     doc_name: str
     section_title: str
     start_line: int
@@ -33,6 +37,8 @@ class Citation(BaseModel):
 
 class ChatResponse(BaseModel):
     """Chat query response."""
+    model_config = ConfigDict(from_attributes=True)
+    
     conversation_id: int
     answer: str
     citations: List[Citation]
@@ -41,41 +47,45 @@ class ChatResponse(BaseModel):
 @router.post("/query", response_model=ChatResponse, status_code=status.HTTP_200_OK)
 async def chat_query(
     request: ChatRequest,
-    session: Session = Depends(get_session)
+    session: Session = Depends(get_session),
+    rag_service: RAGService = Depends(get_rag_service_dep)
 ) -> ChatResponse:
-    """Process a chat query using RAG."""
+    """
+    Process a chat query using RAG.
+    
+    Args:
+        request: Chat request with message and optional conversation_id
         session: Database session
+        rag_service: Preloaded RAG service
         
     Returns:
         Response with conversation_id, answer, and citations
     """
     logger.info(
-        f"Chat query received: conversation_id={request.conversation_id}, "
-        f"message_length={len(request.message)}"
+        "Chat query received: conversation_id=%s, message_length=%d",
+        request.conversation_id, len(request.message)
     )
     
     try:
-        rag_service = get_rag_service()
-        
-        result = rag_service.query(
+        result = await rag_service.query_async(
             message=request.message,
             conversation_id=request.conversation_id,
             session=session
         )
+        # Commit conversation and message writes in one transaction, off the
+        # event loop like the flush that wrote them
+        await asyncio.to_thread(session.commit)
         
         logger.info(
-            f"Chat query completed: conversation_id={result['conversation_id']}, "
-            f"citations_count={len(result['citations'])}"
+            "Chat query completed: conversation_id=%s, citations_count=%d",
+            result["conversation_id"], len(result["citations"])
         )
         
-        return ChatResponse(
-            conversation_id=result["conversation_id"],
-            answer=result["answer"],
-            citations=[Citation(**c) for c in result["citations"]]
-        )
+        # Validate the result (including nested citations) in one pass
+        return ChatResponse.model_validate(result)
     
     except Exception as e:
-        logger.error(f"Chat query failed: {e}", exc_info=True)
+        logger.error("Chat query failed: %s", e, exc_info=True)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to process chat query: {str(e)}"
@@ -85,7 +95,8 @@ async def chat_query(
 @router.get("/conversations/{conversation_id}/messages", response_model=Dict[str, Any])
 async def get_conversation_messages(
     conversation_id: int,
-    session: Session = Depends(get_session)
+    session: Session = Depends(get_read_session),
+    rag_service: RAGService = Depends(get_rag_service_dep)
 ) -> Dict[str, Any]:
     """
     Get all messages for a conversation.
@@ -93,12 +104,12 @@ async def get_conversation_messages(
     Args:
         conversation_id: Conversation ID
         session: Database session
+        rag_service: Preloaded RAG service
         
     Returns:
         List of messages with metadata
     """
     try:
-        rag_service = get_rag_service()
         messages = rag_service.get_conversation_messages(conversation_id, session)
         
         return {
@@ -109,7 +120,7 @@ async def get_conversation_messages(
     
     except Exception as e:
         logger.error(
-            f"Failed to get conversation {conversation_id} messages: {e}"
+            "Failed to get conversation %s messages: %s", conversation_id, e
         )
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -120,7 +131,7 @@ async def get_conversation_messages(
 @router.get("/conversations", response_model=List[Dict[str, Any]])
 async def list_conversations(
     limit: int = 50,
-    session: Session = Depends(get_session)
+    session: Session = Depends(get_read_session)
 ) -> List[Dict[str, Any]]:
     """
     List all conversations ordered by most recent.
@@ -136,23 +147,31 @@ async def list_conversations(
     from sqlmodel import select
     
     try:
-        statement = select(Conversation).order_by(
-            Conversation.updated_at.desc()
+        # Select plain columns to skip ORM object hydration
+        statement = select(
+            Conversation.id,
+            Conversation.title,
+            Conversation.created_at,
+            Conversation.updated_at
+        ).order_by(
+            # updated_at has 1-second resolution; id breaks ties
+            Conversation.updated_at.desc(),
+            Conversation.id.desc()
         ).limit(limit)
-        conversations = session.exec(statement).all()
+        rows = session.exec(statement).all()
         
         return [
             {
-                "id": conv.id,
-                "title": conv.title,
-                "created_at": conv.created_at.isoformat(),
-                "updated_at": conv.updated_at.isoformat()
+                "id": conv_id,
+                "title": title,
+                "created_at": created_at.isoformat(),
+                "updated_at": updated_at.isoformat()
             }
-            for conv in conversations
+            for conv_id, title, created_at, updated_at in rows
         ]
     
     except Exception as e:
-        logger.error(f"Failed to list conversations: {e}")
+        logger.error("Failed to list conversations: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
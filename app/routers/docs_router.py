@@ -4,26 +4,53 @@ Document management router.
 from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, status
 from sqlmodel import Session
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Tuple
+import asyncio
 import logging
-import shutil
+import os
+import uuid
 
-from app.db import get_session
-from app.config import DOCS_DIR, ALLOWED_EXTENSIONS, MAX_FILE_SIZE
-from app.services.document_service import get_document_service
+from app.db import get_session, get_read_session
+from app.config import DOCS_DIR, ALLOWED_EXTENSIONS, MAX_FILE_SIZE, UPLOAD_CHUNK_SIZE
+from app.dependencies import get_document_service_dep
+from app.services.document_service import DocumentService
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/docs", tags=["Documents"])
 
 
+def _create_unique_file(filename: str) -> Tuple[Path, int]:
+    """
+    Atomically create a new file in DOCS_DIR for an upload.
+    
+    Uses the original name if it is free, otherwise appends a short random
+    suffix. O_EXCL makes creation race-free without probing with exists().
+    
+    Args:
+        filename: Uploaded filename (without directory components)
+        
+    Returns:
+        Tuple of (save path, open file descriptor)
+    """
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL
+    stem, extension = os.path.splitext(filename)
+    save_path = DOCS_DIR / filename
+    while True:
+        try:
+            return save_path, os.open(save_path, flags, 0o644)
+        except FileExistsError:
+            save_path = DOCS_DIR / f"{stem}_{uuid.uuid4().hex[:8]}{extension}"
+
+
 @router.post("/upload", response_model=Dict[str, Any], status_code=status.HTTP_201_CREATED)
 async def upload_document(
     file: UploadFile = File(...),
-    session: Session = Depends(get_session)
+    session: Session = Depends(get_session),
+    document_service: DocumentService = Depends(get_document_service_dep)
 ) -> Dict[str, Any]:
     """Upload and process a document (PDF or TXT)."""
-    logger.info(f"Document upload started: {file.filename}")
+    logger.info("Document upload started: %s", file.filename)
     
     try:
         # 1. Validate file type
@@ -33,58 +60,52 @@ async def upload_document(
                 detail="Filename is required"
             )
         
-        file_path = Path(file.filename)
-        file_extension = file_path.suffix.lower()
+        filename = os.path.basename(file.filename)
+        file_extension = os.path.splitext(filename)[1].lower()
         
         if file_extension not in ALLOWED_EXTENSIONS:
-            logger.warning(f"Invalid file type: {file_extension}")
+            logger.warning("Invalid file type: %s", file_extension)
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"File type {file_extension} not allowed. Use: {ALLOWED_EXTENSIONS}"
+                detail=f"File type {file_extension} not allowed. Use: {', '.join(sorted(ALLOWED_EXTENSIONS))}"
             )
         
-        # 2. Validate file size
-        file.file.seek(0, 2)  # Seek to end
-        file_size = file.file.tell()
-        file.file.seek(0)  # Reset to beginning
+        # 2. Create the destination file in storage/docs/
+        save_path, fd = _create_unique_file(filename)
+        
+        logger.debug("Saving file to: %s", save_path)
+        
+        # 3. Stream file to disk, enforcing the size limit as we go
+        file_size = 0
+        with open(fd, "wb", buffering=UPLOAD_CHUNK_SIZE) as buffer:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                file_size += len(chunk)
+                if file_size > MAX_FILE_SIZE:
+                    break
+                buffer.write(chunk)
         
         if file_size > MAX_FILE_SIZE:
-            logger.warning(f"File too large: {file_size} bytes")
+            save_path.unlink(missing_ok=True)
+            logger.warning("File too large: more than %d bytes", MAX_FILE_SIZE)
             raise HTTPException(
                 status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
                 detail=f"File size exceeds maximum of {MAX_FILE_SIZE} bytes"
             )
         
-        logger.info(f"File validation passed: {file_extension}, {file_size} bytes")
-        
-        # 3. Save file to storage/docs/
-        save_path = DOCS_DIR / file.filename
-        
-        # Handle duplicate filenames
-        counter = 1
-        while save_path.exists():
-            stem = file_path.stem
-            save_path = DOCS_DIR / f"{stem}_{counter}{file_extension}"
-            counter += 1
-        
-        logger.info(f"Saving file to: {save_path}")
+        logger.debug("File saved successfully: %s, %d bytes", save_path.name, file_size)
         
-        with open(save_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        logger.info(f"File saved successfully: {save_path.name}")
-        
-        # 4. Process document (extract, chunk, embed, store)
-        document_service = get_document_service()
-        
-        result = document_service.process_document(
+        # 4. Process document (extract, chunk, embed, store); the service
+        # commits the document and its chunks in short transactions of its own.
+        # It blocks for the whole ingestion, so it runs off the event loop.
+        result = await asyncio.to_thread(
+            document_service.process_document,
             file_path=save_path,
             original_filename=file.filename,
             session=session
         )
         
         logger.info(
-            f"Document upload complete: {result['chunk_count']} chunks created"
+            "Document upload complete: %d chunks created", result["chunk_count"]
         )
         
         return {
@@ -101,7 +122,7 @@ async def upload_document(
         raise
     
     except Exception as e:
-        logger.error(f"Document upload failed: {e}", exc_info=True)
+        logger.error("Document upload failed: %s", e, exc_info=True)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to process document: {str(e)}"
@@ -112,18 +133,21 @@ async def upload_document(
 
 
 @router.get("/list", response_model=Dict[str, Any])
-async def list_documents(session: Session = Depends(get_session)) -> Dict[str, Any]:
+async def list_documents(
+    session: Session = Depends(get_read_session),
+    document_service: DocumentService = Depends(get_document_service_dep)
+) -> Dict[str, Any]:
     """
     List all uploaded documents.
     
     Args:
         session: Database session
+        document_service: Preloaded document service
         
     Returns:
         List of documents with metadata
     """
     try:
-        document_service = get_document_service()
         documents = document_service.list_documents(session)
         
         return {
@@ -140,7 +164,7 @@ async def list_documents(session: Session = Depends(get_session)) -> Dict[str, A
         }
     
     except Exception as e:
-        logger.error(f"Failed to list documents: {e}")
+        logger.error("Failed to list documents: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
@@ -150,7 +174,8 @@ async def list_documents(session: Session = Depends(get_session)) -> Dict[str, A
 @router.delete("/{document_id}", response_model=Dict[str, str])
 async def delete_document(
     document_id: int,
-    session: Session = Depends(get_session)
+    session: Session = Depends(get_session),
+    document_service: DocumentService = Depends(get_document_service_dep)
 ) -> Dict[str, str]:
     """
     Delete a document and all its chunks.
@@ -158,12 +183,12 @@ async def delete_document(
     Args:
         document_id: ID of document to delete
         session: Database session
+        document_service: Preloaded document service
         
     Returns:
         Success message
     """
     try:
-        document_service = get_document_service()
         deleted = document_service.delete_document(document_id, session)
         
         if not deleted:
@@ -172,7 +197,7 @@ async def delete_document(
                 detail=f"Document {document_id} not found"
             )
         
-        logger.info(f"Document {document_id} deleted successfully")
+        logger.info("Document %s deleted successfully", document_id)
         return {
             "status": "success",
             "message": f"Document {document_id} deleted"
@@ -182,7 +207,7 @@ async def delete_document(
         raise
     
     except Exception as e:
-        logger.error(f"Failed to delete document {document_id}: {e}")
+        logger.error("Failed to delete document %s: %s", document_id, e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
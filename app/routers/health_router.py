@@ -6,9 +6,10 @@ from sqlmodel import Session, select
 from typing import Dict, Any
 import logging
 
-from app.db import get_session
+from app.db import get_read_session
 from app.models.documents import Document
-from app.services.document_service import get_document_service
+from app.dependencies import get_document_service_dep
+from app.services.document_service import DocumentService
 
 logger = logging.getLogger(__name__)
 
@@ -16,9 +17,12 @@ router = APIRouter(prefix="/health", tags=["Health"])
 
 
 @router.get("", response_model=Dict[str, Any])
-async def health_check(session: Session = Depends(get_session)) -> Dict[str, Any]:
+async def health_check(
+    session: Session = Depends(get_read_session),
+    document_service: DocumentService = Depends(get_document_service_dep)
+) -> Dict[str, Any]:
     """Check system health."""
-    logger.info("Health check requested")
+    logger.debug("Health check requested")
     
     status = {
         "status": "ok",
@@ -38,29 +42,27 @@ async def health_check(session: Session = Depends(get_session)) -> Dict[str, Any
         status["details"]["db_message"] = "Connected and operational"
     
     except Exception as e:
-        logger.error(f"Database check failed: {e}")
+        logger.error("Database check failed: %s", e)
         status["db"] = "error"
         status["status"] = "degraded"
         status["details"]["db_error"] = str(e)
     
     # Check ChromaDB
     try:
-        document_service = get_document_service()
-        
         # Try to list collections
         collections = document_service.chroma_client.list_collections()
         collection_names = [c.name for c in collections]
         
-        logger.debug(f"ChromaDB check passed. Collections: {collection_names}")
+        logger.debug("ChromaDB check passed. Collections: %s", collection_names)
         status["chroma"] = "ok"
         status["details"]["chroma_collections"] = collection_names
         status["details"]["chroma_message"] = "Connected and operational"
     
     except Exception as e:
-        logger.error(f"ChromaDB check failed: {e}")
+        logger.error("ChromaDB check failed: %s", e)
         status["chroma"] = "error"
         status["status"] = "degraded"
         status["details"]["chroma_error"] = str(e)
     
-    logger.info(f"Health check result: {status['status']}")
+    logger.info("Health check result: %s", status["status"])
     return status
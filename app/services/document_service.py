@@ -2,22 +2,120 @@
 Document ingestion service for uploads, extraction, chunking, and vector storage.
 """
 from pathlib import Path
-from typing import Dict, Any
-from sqlmodel import Session, select
+from typing import Dict, Any, Iterator, List, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from sqlmodel import Session, delete, select
 import chromadb
 from chromadb.config import Settings
+import numpy as np
+import atexit
+import hashlib
+import os
+import pickle
+import sqlite3
 import uuid
 import logging
+import queue
+import threading
 
-from app.config import DOCS_DIR, CHROMA_DB_DIR, CHROMA_COLLECTION_NAME
+from app.config import (
+    DOCS_DIR,
+    CHROMA_DB_DIR,
+    CHROMA_COLLECTION_NAME,
+    CHROMA_SQLITE_FILENAME,
+    CHROMA_HNSW_METADATA,
+    CHROMA_UPSERT_BATCH,
+    CHROMA_UPSERT_CONCURRENCY,
+    CHUNK_CACHE_DIR,
+    CHUNK_CACHE_ENABLED,
+    CHUNK_SIZE,
+    CHUNK_OVERLAP,
+    SEPARATORS,
+    SECTION_HEADING_PATTERN,
+    UPLOAD_CHUNK_SIZE
+)
 from app.models.documents import Document
 from app.models.chunks import Chunk
-from app.utils.pdf_utils import extract_text
-from app.utils.chunking import chunk_with_sections
+from app.utils.pdf_utils import EFFECTIVE_PDF_BACKEND, extract_text_iter
+from app.utils.chunking import iter_chunks_with_sections
+from app.utils.text_utils import TextStats
 from app.services.llm_service import get_llm_service
 
 logger = logging.getLogger(__name__)
 
+# Shared pool for concurrent ChromaDB upsert batches
+_upsert_executor = ThreadPoolExecutor(
+    max_workers=CHROMA_UPSERT_CONCURRENCY,
+    thread_name_prefix="chroma-upsert"
+)
+# Background stages of the ingestion pipeline
+_extract_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="extract")
+_embed_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="embed")
+
+# Marks the end of a stream passed between pipeline stages
+_STREAM_DONE = object()
+# Extracted text pieces (pages) held ahead of the chunker
+_TEXT_QUEUE_SIZE = 4
+
+
+def _iter_queue(source: queue.Queue) -> Iterator[Any]:
+    """Yield items from a pipeline queue until the end marker."""
+    while (item := source.get()) is not _STREAM_DONE:
+        yield item
+
+
+def _produce_text(file_path: Path, out: queue.Queue, stop: threading.Event) -> None:
+    """Put extracted text pieces on the queue as they are parsed."""
+    try:
+        for part in extract_text_iter(file_path):
+            if stop.is_set():
+                break
+            out.put(part)
+    finally:
+        # Always unblock the consumer, even if extraction fails
+        out.put(_STREAM_DONE)
+
+
+# Process-wide ChromaDB client; opening it replays the SQLite/HNSW state
+_chroma_client = None
+_chroma_client_lock = threading.Lock()
+
+
+def _enable_chroma_wal() -> None:
+    """Switch ChromaDB's SQLite store to WAL so readers don't block on upserts."""
+    # journal_mode=WAL is persistent in the database file, so setting it once
+    # through a short-lived connection covers every connection chromadb opens
+    conn = sqlite3.connect(CHROMA_DB_DIR / CHROMA_SQLITE_FILENAME)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+    finally:
+        conn.close()
+
+
+def get_chroma_client() -> chromadb.PersistentClient:
+    """Return the process-wide ChromaDB client."""
+    global _chroma_client
+    if _chroma_client is None:
+        with _chroma_client_lock:
+            if _chroma_client is None:
+                logger.info("Opening ChromaDB at %s", CHROMA_DB_DIR)
+                try:
+                    _enable_chroma_wal()
+                except sqlite3.Error as e:
+                    logger.warning("Could not enable WAL for ChromaDB: %s", e)
+                _chroma_client = chromadb.PersistentClient(
+                    path=str(CHROMA_DB_DIR),
+                    settings=Settings(anonymized_telemetry=False)
+                )
+    return _chroma_client
+
+
+@atexit.register
+def _shutdown_executors() -> None:
+    # Drop queued ingestion work at exit instead of draining it
+    for executor in (_extract_executor, _embed_executor, _upsert_executor):
+        executor.shutdown(wait=False, cancel_futures=True)
+
 
 class DocumentService:
     """
@@ -27,17 +125,14 @@ class DocumentService:
     def __init__(self):
         logger.info("Initializing DocumentService")
         try:
-            self.chroma_client = chromadb.PersistentClient(
-                path=str(CHROMA_DB_DIR),
-                settings=Settings(anonymized_telemetry=False)
-            )
+            self.chroma_client = get_chroma_client()
             self.collection = self.chroma_client.get_or_create_collection(
                 name=CHROMA_COLLECTION_NAME,
-                metadata={"description": "Document chunks"}
+                metadata={"description": "Document chunks", **CHROMA_HNSW_METADATA}
             )
-            logger.info(f"ChromaDB collection '{CHROMA_COLLECTION_NAME}' ready")
+            logger.info("ChromaDB collection '%s' ready", CHROMA_COLLECTION_NAME)
         except Exception as e:
-            logger.error(f"Failed to initialize ChromaDB: {e}")
+            logger.error("Failed to initialize ChromaDB: %s", e)
             raise
         self.llm_service = get_llm_service()
     
@@ -49,78 +144,325 @@ class DocumentService:
     ) -> Dict[str, Any]:
         """
         Extracts text, chunks, embeds, and stores a document.
-        Returns a summary dict.
+        Runs as a pipeline: pages are extracted on one thread and chunked
+        as they arrive, chunk batches are embedded on another, and ChromaDB
+        upserts start as each embedding batch completes. Chunks and
+        embeddings of previously ingested file content come from the chunk
+        cache instead. The document row and the chunk rows are committed in
+        two short transactions, before and after the slow work, so no SQLite
+        write lock is held while parsing or embedding; on failure the
+        document row is removed again. Returns a summary dict.
         """
-        logger.info(f"Processing document: {original_filename}")
+        logger.info("Processing document: %s", original_filename)
         try:
-            full_text = extract_text(file_path)
-            if not full_text or not full_text.strip():
-                raise ValueError("No text content extracted from document")
-            line_count = len(full_text.splitlines())
-            logger.info(f"Extracted {line_count} lines, {len(full_text)} characters")
             document = Document(
                 name=original_filename,
                 path=str(file_path.relative_to(DOCS_DIR.parent))
             )
+            # Committed on its own so the ID is assigned without keeping a
+            # write transaction open through extraction and embedding
             session.add(document)
             session.commit()
-            session.refresh(document)
-            logger.info(f"Created document record with ID: {document.id}")
-            chunks_data = chunk_with_sections(full_text)
-            if not chunks_data:
+            document_id = document.id
+            logger.info("Created document record with ID: %d", document_id)
+            try:
+                return self._ingest(file_path, original_filename, document_id, session)
+            except Exception:
+                self._discard_document(document_id, session)
+                raise
+        except Exception as e:
+            logger.error("Failed to process document %s: %s", original_filename, e)
+            raise
+    
+    def _ingest(
+        self,
+        file_path: Path,
+        original_filename: str,
+        document_id: int,
+        session: Session
+    ) -> Dict[str, Any]:
+        """Run the ingestion pipeline for a committed document row."""
+        cache_key = self._chunk_cache_key(file_path) if CHUNK_CACHE_ENABLED else None
+        cached = self._load_cached_chunks(cache_key) if cache_key else None
+        cached_embeddings = self._load_cached_embeddings(cache_key) if cached else None
+        # Only running totals are kept; the text itself streams through
+        text_stats = TextStats()
+        extract_future = None
+        if cached:
+            logger.info("Using cached chunks for %s", original_filename)
+            chunk_source = cached["chunks"]
+        else:
+            # Bounded, so extraction can't run far ahead of the chunker
+            text_queue = queue.Queue(maxsize=_TEXT_QUEUE_SIZE)
+            stop_extract = threading.Event()
+            extract_future = _extract_executor.submit(
+                _produce_text, file_path, text_queue, stop_extract
+            )
+            chunk_source = iter_chunks_with_sections(self._collect(text_queue, text_stats))
+        embedding_queue = queue.Queue()
+        batch_queue = None
+        embed_future = None
+        if cached_embeddings is not None:
+            for start in range(0, cached_embeddings.shape[0], CHROMA_UPSERT_BATCH):
+                embedding_queue.put(cached_embeddings[start:start + CHROMA_UPSERT_BATCH])
+            embedding_queue.put(_STREAM_DONE)
+        else:
+            batch_queue = queue.Queue()
+            embed_future = _embed_executor.submit(
+                self._produce_embeddings, batch_queue, embedding_queue
+            )
+        chunk_ids = []
+        chunk_contents = []
+        chunk_metadatas = []
+        chunk_rows = []
+        chunk_id_prefix = f"doc_{document_id}_chunk_"
+        upsert_futures = []
+        # Whole-document embeddings are only kept to write the cache
+        keep_embeddings = cache_key is not None and cached_embeddings is None
+        embedding_batches = []
+        embedded = 0
+        embeddings_done = False
+        
+        def submit_upserts(block: bool) -> None:
+            # Upsert embedding batches as they come back; without block, only
+            # those already waiting, so chunking carries on in between
+            nonlocal embedded, embeddings_done
+            while not embeddings_done:
+                if not block and embedding_queue.empty():
+                    return
+                embeddings = embedding_queue.get()
+                if embeddings is _STREAM_DONE:
+                    embeddings_done = True
+                    return
+                end = embedded + embeddings.shape[0]
+                upsert_futures.append(_upsert_executor.submit(
+                    self._upsert_batch,
+                    ids=chunk_ids[embedded:end],
+                    embeddings=embeddings,
+                    documents=chunk_contents[embedded:end],
+                    metadatas=chunk_metadatas[embedded:end]
+                ))
+                if keep_embeddings:
+                    embedding_batches.append(embeddings)
+                embedded = end
+        
+        try:
+            try:
+                batch_start = 0
+                for idx, (content, start_line, end_line, section_title) in enumerate(chunk_source):
+                    chunk_id = chunk_id_prefix + str(idx)
+                    chunk_ids.append(chunk_id)
+                    chunk_contents.append(content)
+                    metadata = {
+                        "chunk_id": chunk_id,
+                        "doc_name": original_filename,
+                        "section_title": section_title,
+                        "start_line": start_line,
+                        "end_line": end_line,
+                        "document_id": document_id
+                    }
+                    chunk_metadatas.append(metadata)
+                    chunk_rows.append({
+                        "document_id": document_id,
+                        "chunk_id": chunk_id,
+                        "content": content,
+                        "start_line": start_line,
+                        "end_line": end_line,
+                        "section_title": section_title
+                    })
+                    if batch_queue is not None:
+                        # Hand off each upsert-sized batch while later pages parse
+                        if len(chunk_contents) - batch_start == CHROMA_UPSERT_BATCH:
+                            batch_queue.put(chunk_contents[batch_start:])
+                            batch_start = len(chunk_contents)
+                        # and upsert the batches embedded so far
+                        submit_upserts(block=False)
+                if batch_queue is not None and batch_start < len(chunk_contents):
+                    batch_queue.put(chunk_contents[batch_start:])
+            finally:
+                if batch_queue is not None:
+                    batch_queue.put(_STREAM_DONE)
+                if extract_future is not None:
+                    # If chunking stopped early, release an extractor blocked
+                    # on the full queue so its worker thread comes back
+                    stop_extract.set()
+                    while not extract_future.done():
+                        try:
+                            text_queue.get(timeout=0.1)
+                        except queue.Empty:
+                            pass
+            if cached:
+                line_count = cached["line_count"]
+                character_count = cached["character_count"]
+            else:
+                extract_future.result()  # Re-raise extraction failures
+                if not text_stats.has_content:
+                    raise ValueError("No text content extracted from document")
+                line_count = text_stats.line_count
+                character_count = text_stats.character_count
+            logger.info("Extracted %d lines, %d characters", line_count, character_count)
+            if not chunk_rows:
                 raise ValueError("No chunks created from document")
-            logger.info(f"Created {len(chunks_data)} chunks")
-            chunk_ids = []
-            chunk_contents = []
-            chunk_metadatas = []
-            for idx, (content, start_line, end_line, section_title) in enumerate(chunks_data):
-                chunk_id = f"doc_{document.id}_chunk_{idx}"
-                chunk_ids.append(chunk_id)
-                chunk_contents.append(content)
-                metadata = {
-                    "chunk_id": chunk_id,
-                    "doc_name": original_filename,
-                    "section_title": section_title,
-                    "start_line": start_line,
-                    "end_line": end_line,
-                    "document_id": document.id
-                }
-                chunk_metadatas.append(metadata)
-                chunk = Chunk(
-                    document_id=document.id,
-                    chunk_id=chunk_id,
-                    content=content,
-                    start_line=start_line,
-                    end_line=end_line,
-                    section_title=section_title
-                )
-                session.add(chunk)
-            session.commit()
-            logger.info(f"Saved {len(chunks_data)} chunks to database")
-            embeddings = self.llm_service.embed_batch(chunk_contents)
-            if len(embeddings) != len(chunk_ids):
+            logger.info("Created %d chunks", len(chunk_rows))
+            # Upsert the batches still being embedded as each one is ready
+            submit_upserts(block=True)
+            if embed_future is not None:
+                embed_future.result()  # Re-raise embedding failures
+            for future in as_completed(upsert_futures):
+                future.result()  # Re-raise the first upsert failure
+            if embedded != len(chunk_ids):
                 raise ValueError("Embedding count mismatch")
-            logger.info(f"Generated {len(embeddings)} embeddings")
-            self.collection.upsert(
-                ids=chunk_ids,
-                embeddings=embeddings,
-                documents=chunk_contents,
-                metadatas=chunk_metadatas
-            )
-            logger.info(f"Successfully upserted {len(chunk_ids)} chunks to ChromaDB")
-            result = {
-                "document_id": document.id,
-                "document_name": original_filename,
-                "line_count": line_count,
-                "character_count": len(full_text),
-                "chunk_count": len(chunks_data),
-                "status": "success"
-            }
-            logger.info(f"Document processing complete: {result}")
-            return result
-        except Exception as e:
-            logger.error(f"Failed to process document {original_filename}: {e}")
+            logger.info("Generated %d embeddings", embedded)
+            logger.info("Successfully upserted %d chunks to ChromaDB", len(chunk_ids))
+            # Chunk rows are written only now, in one short transaction, so the
+            # SQLite write lock isn't held while pages parse or batches embed.
+            # A single executemany, skipping ORM objects.
+            session.execute(Chunk.__table__.insert(), chunk_rows)
+            session.commit()
+        except Exception:
+            # Vectors already sent would otherwise outlive the document and
+            # collide with a later document that gets the same ID
+            wait(upsert_futures)
+            self._discard_vectors(chunk_ids[:embedded])
             raise
+        logger.info("Saved %d chunks to database", len(chunk_rows))
+        if cache_key:
+            if not cached:
+                self._save_cached_chunks(cache_key, {
+                    "chunks": [
+                        (row["content"], row["start_line"], row["end_line"], row["section_title"])
+                        for row in chunk_rows
+                    ],
+                    "line_count": line_count,
+                    "character_count": character_count
+                })
+            if cached_embeddings is None:
+                self._save_cached_embeddings(cache_key, np.concatenate(embedding_batches))
+        result = {
+            "document_id": document_id,
+            "document_name": original_filename,
+            "line_count": line_count,
+            "character_count": character_count,
+            "chunk_count": len(chunk_rows),
+            "status": "success"
+        }
+        logger.info("Document processing complete: %s", result)
+        return result
+    
+    def _discard_vectors(self, chunk_ids: List[str]) -> None:
+        """Remove the ChromaDB vectors of a document whose ingestion failed."""
+        if not chunk_ids:
+            return
+        try:
+            self.collection.delete(ids=chunk_ids)
+            logger.info("Removed %d orphaned chunks from ChromaDB", len(chunk_ids))
+        except Exception as e:
+            logger.warning("Failed to remove orphaned chunks from ChromaDB: %s", e)
+    
+    @staticmethod
+    def _discard_document(document_id: int, session: Session) -> None:
+        """Remove the row of a document whose ingestion failed."""
+        try:
+            session.rollback()
+            session.exec(delete(Document).where(Document.id == document_id))
+            session.commit()
+        except Exception as e:
+            logger.warning("Failed to remove document record %d: %s", document_id, e)
+    
+    @staticmethod
+    def _chunk_cache_key(file_path: Path) -> str:
+        """Hash the file content together with the extraction and chunking settings."""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(repr((
+            EFFECTIVE_PDF_BACKEND,
+            CHUNK_SIZE, CHUNK_OVERLAP, SEPARATORS, SECTION_HEADING_PATTERN
+        )).encode())
+        with open(file_path, "rb") as f:
+            while block := f.read(UPLOAD_CHUNK_SIZE):
+                digest.update(block)
+        return digest.hexdigest()
+    
+    def _embedding_cache_path(self, cache_key: str) -> Path:
+        model_tag = hashlib.blake2b(
+            self.llm_service.model_name.encode(), digest_size=8
+        ).hexdigest()
+        return CHUNK_CACHE_DIR / f"{cache_key}.{model_tag}.npy"
+    
+    @staticmethod
+    def _load_cached_chunks(cache_key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(CHUNK_CACHE_DIR / f"{cache_key}.pkl", "rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("Ignoring unreadable chunk cache entry %s: %s", cache_key, e)
+            return None
+    
+    def _load_cached_embeddings(self, cache_key: str) -> Optional[np.ndarray]:
+        try:
+            return np.load(self._embedding_cache_path(cache_key))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("Ignoring unreadable embedding cache entry %s: %s", cache_key, e)
+            return None
+    
+    @staticmethod
+    def _save_cached_chunks(cache_key: str, entry: Dict[str, Any]) -> None:
+        path = CHUNK_CACHE_DIR / f"{cache_key}.pkl"
+        tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)  # Atomic, so readers never see partial files
+        except Exception as e:
+            tmp_path.unlink(missing_ok=True)
+            logger.warning("Failed to write chunk cache entry %s: %s", cache_key, e)
+    
+    def _save_cached_embeddings(self, cache_key: str, embeddings: np.ndarray) -> None:
+        path = self._embedding_cache_path(cache_key)
+        tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            with open(tmp_path, "wb") as f:
+                np.save(f, embeddings)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            tmp_path.unlink(missing_ok=True)
+            logger.warning("Failed to write embedding cache entry %s: %s", cache_key, e)
+    
+    @staticmethod
+    def _collect(source: queue.Queue, stats: TextStats) -> Iterator[str]:
+        """Yield text pieces from the extraction queue, updating running stats."""
+        for part in _iter_queue(source):
+            stats.feed(part)
+            yield part
+        stats.close()
+    
+    def _upsert_batch(
+        self,
+        ids: List[str],
+        embeddings: np.ndarray,
+        documents: List[str],
+        metadatas: List[Dict[str, Any]]
+    ) -> None:
+        """Upsert one batch, converting its embeddings on the worker thread."""
+        # chromadb 0.4.x only accepts nested lists, so convert at the boundary
+        self.collection.upsert(
+            ids=ids,
+            embeddings=embeddings.tolist(),
+            documents=documents,
+            metadatas=metadatas
+        )
+    
+    def _produce_embeddings(self, batches: queue.Queue, out: queue.Queue) -> None:
+        """Embed each queued batch of chunk texts and put the result on out."""
+        try:
+            for texts in _iter_queue(batches):
+                out.put(self.llm_service.embed_batch(texts))
+        finally:
+            # Always unblock the consumer, even if encoding fails
+            out.put(_STREAM_DONE)
     
     def get_document_by_id(self, document_id: int, session: Session) -> Document:
         """Get a document by its ID."""
@@ -138,38 +480,40 @@ class DocumentService:
             document = self.get_document_by_id(document_id, session)
             if not document:
                 return False
-            chunk_statement = select(Chunk).where(Chunk.document_id == document_id)
-            chunks = list(session.exec(chunk_statement))
-            if chunks:
-                chunk_ids = [chunk.chunk_id for chunk in chunks]
+            # Only the IDs are needed for ChromaDB; rows go in one DELETE
+            chunk_statement = select(Chunk.chunk_id).where(Chunk.document_id == document_id)
+            chunk_ids = list(session.exec(chunk_statement))
+            if chunk_ids:
                 self.collection.delete(ids=chunk_ids)
-                logger.info(f"Deleted {len(chunk_ids)} chunks from ChromaDB")
-            for chunk in chunks:
-                session.delete(chunk)
+                logger.info("Deleted %d chunks from ChromaDB", len(chunk_ids))
+                session.exec(delete(Chunk).where(Chunk.document_id == document_id))
             try:
                 file_path = Path(document.path)
                 if file_path.exists():
                     file_path.unlink()
-                    logger.info(f"Deleted file: {file_path}")
+                    logger.info("Deleted file: %s", file_path)
             except Exception as e:
-                logger.warning(f"Failed to delete file: {e}")
+                logger.warning("Failed to delete file: %s", e)
             session.delete(document)
             session.commit()
-            logger.info(f"Deleted document {document_id}")
+            logger.info("Deleted document %d", document_id)
             return True
         except Exception as e:
-            logger.error(f"Failed to delete document {document_id}: {e}")
+            logger.error("Failed to delete document %d: %s", document_id, e)
             raise
 
 
 # Global singleton instance
 _document_service_instance = None
+_document_service_lock = threading.Lock()
 
 
 def get_document_service() -> DocumentService:
     """Return the global DocumentService instance."""
     global _document_service_instance
     if _document_service_instance is None:
-        logger.info("Initializing global DocumentService")
-        _document_service_instance = DocumentService()
+        with _document_service_lock:
+            if _document_service_instance is None:
+                logger.info("Initializing global DocumentService")
+                _document_service_instance = DocumentService()
     return _document_service_instance
@@ -2,20 +2,55 @@
 Embeddings and text generation using sentence-transformers and OpenAI.
 """
 from typing import List
+from functools import lru_cache
 from sentence_transformers import SentenceTransformer
-from openai import OpenAI
+import numpy as np
+import torch
+from openai import AsyncOpenAI
 from app.config import (
     EMBEDDING_MODEL_NAME,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_GPU_BATCH_SIZE,
+    EMBEDDING_PRECISION,
     OPENAI_API_KEY,
     OPENAI_MODEL,
     OPENAI_TEMPERATURE,
-    OPENAI_MAX_TOKENS
+    OPENAI_MAX_TOKENS,
+    OPENAI_WARMUP
 )
+import importlib.util
 import logging
+import threading
 
 logger = logging.getLogger(__name__)
 
 
+@lru_cache(maxsize=None)
+def _get_embedding_model(model_name: str, device: str) -> SentenceTransformer:
+    # Load each embedding model once per process and share it across instances
+    logger.info("Loading embedding model: %s on %s", model_name, device)
+    precision = EMBEDDING_PRECISION
+    if precision == "auto" or (precision == "fp16" and device != "cuda"):
+        # fp16 kernels are slow on CPU
+        precision = "fp16" if device == "cuda" else "fp32"
+    # Reduced precision halves memory traffic; bf16 on CPU needs AVX-512 BF16
+    # or AMX hardware to be faster, so it is opt-in. Loading straight into the
+    # target dtype avoids materializing an fp32 copy first.
+    model_kwargs = {}
+    if precision == "fp16":
+        model_kwargs["torch_dtype"] = torch.float16
+    elif precision == "bf16":
+        model_kwargs["torch_dtype"] = torch.bfloat16
+    # Memory-map safetensors weights instead of copying them into a freshly
+    # initialized model; workers then share read-only pages via the page cache.
+    # transformers needs accelerate for this path.
+    if importlib.util.find_spec("accelerate") is not None:
+        model_kwargs["low_cpu_mem_usage"] = True
+    model = SentenceTransformer(model_name, device=device, model_kwargs=model_kwargs)
+    logger.info("Embedding model precision: %s", precision)
+    return model
+
+
 class LLMService:
     # Handles embeddings and LLM text generation
     
@@ -23,19 +58,22 @@ class LLMService:
         # Initialize embedding model and OpenAI client
         logger.info("Initializing LLM service")
         self.model_name = model_name
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.batch_size = (
+            EMBEDDING_GPU_BATCH_SIZE if self.device == "cuda" else EMBEDDING_BATCH_SIZE
+        )
         self.embedding_model = None
         self.openai_client = None
         self._load_embedding_model()
         self._initialize_openai()
     
     def _load_embedding_model(self):
-        # Load embedding model
-        logger.info(f"Loading embedding model: {self.model_name}")
+        # Load embedding model (cached per model name)
         try:
-            self.embedding_model = SentenceTransformer(self.model_name)
+            self.embedding_model = _get_embedding_model(self.model_name, self.device)
             logger.info("Embedding model loaded successfully")
         except Exception as e:
-            logger.error(f"Failed to load embedding model: {e}")
+            logger.error("Failed to load embedding model: %s", e)
             raise
     
     def _initialize_openai(self):
@@ -46,65 +84,96 @@ class LLMService:
             return
         
         try:
-            self.openai_client = OpenAI(api_key=OPENAI_API_KEY)
-            logger.info(f"OpenAI client initialized with model: {OPENAI_MODEL}")
+            # Async client so requests await the API instead of holding a thread
+            self.openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+            logger.info("OpenAI client initialized with model: %s", OPENAI_MODEL)
         except Exception as e:
-            logger.error(f"Failed to initialize OpenAI client: {e}")
+            logger.error("Failed to initialize OpenAI client: %s", e)
             self.openai_client = None
     
-    def embed_text(self, text: str) -> List[float]:
-        # Return embedding for a single text
+    def warmup(self):
+        # Run a throwaway encode so the first real request skips cold-start costs
+        try:
+            self.embedding_model.encode(
+                ["warmup"],
+                convert_to_numpy=True,
+                show_progress_bar=False
+            )
+            logger.info("Embedding model warmed up")
+        except Exception as e:
+            logger.warning("Embedding model warmup failed: %s", e)
+    
+    async def warmup_openai(self):
+        # Open the client's connection pool with a 1-token request
+        if not self.openai_client or not OPENAI_WARMUP:
+            return
+        
+        try:
+            # Short timeout, no retries: an unreachable API mustn't hold up startup.
+            # The copy shares the client's connection pool, so the warmup still counts.
+            await self.openai_client.with_options(timeout=5, max_retries=0).chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=[{"role": "user", "content": "ping"}],
+                max_tokens=1
+            )
+            logger.info("OpenAI client warmed up")
+        except Exception as e:
+            logger.warning("OpenAI warmup failed: %s", e)
+    
+    def embed_text(self, text: str) -> np.ndarray:
+        # Return embedding for a single text as a float32 (D,) array
         try:
             if not text or not text.strip():
                 logger.warning("Attempted to embed empty text")
-                return []
+                return np.empty(0, dtype=np.float32)
             
             # Generate embedding
             embedding = self.embedding_model.encode(
                 text,
-                convert_to_tensor=False,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
                 show_progress_bar=False
             )
             
-            # Convert to list
-            embedding_list = embedding.tolist()
+            # float32 regardless of model precision (numpy has no bf16)
+            embedding = np.asarray(embedding, dtype=np.float32)
             
             logger.debug(
-                f"Generated embedding of dimension {len(embedding_list)} "
-                f"for text of length {len(text)}"
+                "Generated embedding of dimension %d for text of length %d",
+                embedding.shape[0], len(text)
             )
             
-            return embedding_list
+            return embedding
         
         except Exception as e:
-            logger.error(f"Failed to generate embedding: {e}")
+            logger.error("Failed to generate embedding: %s", e)
             raise
     
-    def embed_batch(self, texts: List[str]) -> List[List[float]]:
-        # Return embeddings for a list of texts
+    def embed_batch(self, texts: List[str]) -> np.ndarray:
+        # Return embeddings for a list of texts as a float32 (N, D) array
         try:
             if not texts:
-                return []
+                return np.empty((0, 0), dtype=np.float32)
             
-            logger.info(f"Generating embeddings for {len(texts)} texts")
+            logger.info("Generating embeddings for %d texts", len(texts))
             
             embeddings = self.embedding_model.encode(
                 texts,
-                convert_to_tensor=False,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
                 show_progress_bar=False,
-                batch_size=32
+                batch_size=self.batch_size
             )
+            embeddings = np.asarray(embeddings, dtype=np.float32)
             
-            embeddings_list = [emb.tolist() for emb in embeddings]
-            
-            logger.info(f"Successfully generated {len(embeddings_list)} embeddings")
-            return embeddings_list
+            logger.info("Successfully generated %d embeddings", embeddings.shape[0])
+            return embeddings
         
         except Exception as e:
-            logger.error(f"Failed to generate batch embeddings: {e}")
+            logger.error("Failed to generate batch embeddings: %s", e)
             raise
     
-    def generate(self, prompt: str) -> str:
+    async def generate(self, prompt: str) -> str:
         # Generate text using OpenAI API
         if not self.openai_client:
             error_msg = "OpenAI client not initialized. Please set OPENAI_API_KEY in .env file."
@@ -112,10 +181,10 @@ class LLMService:
             return error_msg
         
         try:
-            logger.info(f"Generating response with {OPENAI_MODEL}")
-            logger.debug(f"Prompt length: {len(prompt)} characters")
+            logger.info("Generating response with %s", OPENAI_MODEL)
+            logger.debug("Prompt length: %d characters", len(prompt))
             
-            response = self.openai_client.chat.completions.create(
+            response = await self.openai_client.chat.completions.create(
                 model=OPENAI_MODEL,
                 messages=[
                     {
@@ -136,8 +205,9 @@ class LLMService:
             )
             
             generated_text = response.choices[0].message.content
-            logger.info(f"Generated response of {len(generated_text)} characters")
-            logger.debug(f"Response preview: {generated_text[:100]}...")
+            logger.info("Generated response of %d characters", len(generated_text))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Response preview: %s...", generated_text[:100])
             
             return generated_text
             
@@ -149,6 +219,7 @@ class LLMService:
 
 # Singleton instance
 _llm_service_instance = None
+_llm_service_lock = threading.Lock()
 
 
 def get_llm_service() -> LLMService:
@@ -156,7 +227,9 @@ def get_llm_service() -> LLMService:
     global _llm_service_instance
     
     if _llm_service_instance is None:
-        logger.info("Initializing global LLM service")
-        _llm_service_instance = LLMService()
+        with _llm_service_lock:
+            if _llm_service_instance is None:
+                logger.info("Initializing global LLM service")
+                _llm_service_instance = LLMService()
     
     return _llm_service_instance
@@ -1,19 +1,161 @@
 """
 Retrieval-Augmented Generation (RAG) service for chat and document retrieval.
 """
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 from sqlmodel import Session, select
-from datetime import datetime
+from sqlalchemy import func
+from sqlalchemy.orm import aliased
+import numpy as np
+import asyncio
+import hashlib
+import io
 import logging
+import re
+import threading
+import time
 
 from app.models.conversations import Conversation
 from app.models.messages import Message
-from app.config import RETRIEVAL_TOP_K, CONVERSATION_HISTORY_LENGTH
+from app.config import (
+    RETRIEVAL_TOP_K,
+    CONVERSATION_HISTORY_LENGTH,
+    QUERY_EMBEDDING_CACHE_SIZE,
+    QUERY_BATCH_WINDOW_MS,
+    QUERY_BATCH_MAX_SIZE,
+    QUERY_BATCH_TIMEOUT_S
+)
 from app.services.llm_service import get_llm_service
 from app.services.document_service import get_document_service
 
 logger = logging.getLogger(__name__)
 
+# Sentence end followed by the capital letter that starts the next sentence
+_SENTENCE_START_RE = re.compile(r'[.!?]\s+([A-Z])')
+# Citation markers like [1], [2] in LLM answers
+_CITATION_RE = re.compile(r'\[(\d+)\]')
+
+# Fixed system instruction that opens every RAG prompt
+_PROMPT_PREAMBLE = (
+    "You are an AI assistant that answers strictly from company policy documents.\n"
+    "IMPORTANT: When answering, cite the sources you use by referencing their numbers (e.g., [1], [2]).\n"
+    "Only cite sources that directly support your answer.\n"
+    "If the answer is not in the context, say:\n"
+    '"I could not find this information in the provided company policies."\n'
+    "\n"
+)
+
+# Per-query result fields returned by ChromaDB
+_QUERY_INCLUDE = ["documents", "metadatas", "distances"]
+
+
+@dataclass
+class RetrievedBatch:
+    """Retrieved chunks as parallel lists, in rank order."""
+    contents: List[str] = field(default_factory=list)
+    metadatas: List[Dict[str, Any]] = field(default_factory=list)
+    distances: List[Optional[float]] = field(default_factory=list)
+    
+    def __len__(self) -> int:
+        return len(self.contents)
+
+
+class _QueryBatcher:
+    """
+    Groups concurrent ChromaDB queries into a single batched call.
+    
+    Callers block on query(); a background worker collects requests for up
+    to window_ms (or until max_size are pending), issues one
+    collection.query per distinct n_results, and hands each caller its own
+    row of the results. A caller gives up after timeout seconds.
+    """
+    
+    def __init__(self, collection, window_ms: float, max_size: int, timeout: float):
+        self.collection = collection
+        self.window = window_ms / 1000
+        self.max_size = max_size
+        self.timeout = timeout
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._worker = threading.Thread(
+            target=self._run, name="chroma-query-batcher", daemon=True
+        )
+        self._worker.start()
+    
+    def query(self, embedding: np.ndarray, n_results: int) -> Dict[str, Any]:
+        """Queue one query and wait for its single-query shaped results."""
+        future = Future()
+        with self._cond:
+            self._pending.append((embedding, n_results, future))
+            self._cond.notify()
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # Dropped from its batch if the worker hasn't picked it up yet
+            future.cancel()
+            raise
+    
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                # Give concurrent callers a short window to join this batch
+                deadline = time.monotonic() + self.window
+                while len(self._pending) < self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = [
+                    self._pending.popleft()
+                    for _ in range(min(len(self._pending), self.max_size))
+                ]
+            
+            # Any failure is handed to this batch's callers; the worker
+            # must keep serving later batches
+            try:
+                batch = [
+                    request for request in batch
+                    if request[2].set_running_or_notify_cancel()
+                ]
+                groups: Dict[int, list] = {}
+                for request in batch:
+                    groups.setdefault(request[1], []).append(request)
+                for n_results, requests in groups.items():
+                    self._execute(n_results, requests)
+            except Exception as e:
+                logger.exception("Batched ChromaDB query failed")
+                self._fail(batch, e)
+    
+    def _execute(self, n_results: int, requests: list) -> None:
+        try:
+            # One (N, D) -> nested list conversion for the whole batch
+            results = self.collection.query(
+                query_embeddings=np.stack(
+                    [embedding for embedding, _, _ in requests]
+                ).tolist(),
+                n_results=n_results,
+                include=_QUERY_INCLUDE
+            )
+            for i, (_, _, future) in enumerate(requests):
+                future.set_result({
+                    key: [results[key][i]]
+                    for key in ("ids", *_QUERY_INCLUDE)
+                    if results.get(key) is not None
+                })
+        except Exception as e:
+            self._fail(requests, e)
+    
+    @staticmethod
+    def _fail(requests: list, error: Exception) -> None:
+        """Fail every request that doesn't have a result yet."""
+        for _, _, future in requests:
+            if not future.done():
+                future.set_exception(error)
+
 
 class RAGService:
     # Manages RAG chat interactions
@@ -24,107 +166,141 @@ class RAGService:
         self.llm_service = get_llm_service()
         self.document_service = get_document_service()
         self.collection = self.document_service.collection
+        # LRU of query embeddings keyed by a digest of the normalized query
+        self._embed_cache: OrderedDict[bytes, np.ndarray] = OrderedDict()
+        self._embed_cache_lock = threading.Lock()
+        self._query_batcher = None
+        if QUERY_BATCH_WINDOW_MS > 0:
+            self._query_batcher = _QueryBatcher(
+                self.collection, QUERY_BATCH_WINDOW_MS, QUERY_BATCH_MAX_SIZE,
+                QUERY_BATCH_TIMEOUT_S
+            )
     
-    def query(
+    async def query_async(
         self,
         message: str,
         conversation_id: Optional[int],
         session: Session,
         top_k: int = RETRIEVAL_TOP_K
     ) -> Dict[str, Any]:
-        # Main RAG query handler
-        logger.info(f"Processing RAG query (conversation_id={conversation_id})")
+        # Main RAG query handler. Blocking DB, embedding and ChromaDB work runs
+        # in worker threads; only the LLM call is awaited on the event loop.
+        logger.info("Processing RAG query (conversation_id=%s)", conversation_id)
         
         try:
-            # 1. Get or create conversation
-            if conversation_id:
-                conversation = self._get_conversation(conversation_id, session)
-                if not conversation:
-                    logger.warning(f"Conversation {conversation_id} not found, creating new")
-                    conversation = self._create_conversation(session, message)
-            else:
-                conversation = self._create_conversation(session, message)
-            
-            logger.info(f"Using conversation ID: {conversation.id}")
-            
-            # 2. Save user message
-            user_message = Message(
-                conversation_id=conversation.id,
-                role="user",
-                content=message
+            # 1-4. Load history, retrieve chunks and build the prompt
+            conversation, retrieved_chunks, prompt = await asyncio.to_thread(
+                self._prepare_query, message, conversation_id, session, top_k
             )
-            session.add(user_message)
-            
-            # 3. Update conversation timestamp
-            from datetime import datetime
-            conversation.updated_at = datetime.utcnow()
-            session.add(conversation)
             
-            session.commit()
-            logger.debug(f"Saved user message: {message[:100]}...")
-            
-            # 3. Get conversation history
-            history_messages = self._get_conversation_history(
-                conversation.id,
-                session,
-                limit=CONVERSATION_HISTORY_LENGTH
-            )
-            
-            # 4. Retrieve relevant chunks
-            logger.info(f"Retrieving top {top_k} relevant chunks")
-            retrieved_chunks = self._retrieve_chunks(message, top_k)
-            
-            logger.info(f"Retrieved {len(retrieved_chunks)} chunks")
-            
-            # 5. Build RAG prompt
-            prompt = self._build_rag_prompt(
-                user_message=message,
-                history_messages=history_messages,
-                retrieved_chunks=retrieved_chunks
-            )
-            
-            logger.debug(f"Built prompt of length {len(prompt)}")
-            
-            # 6. Generate response using LLM
+            # 5. Generate response using LLM
             logger.info("Generating LLM response")
-            answer = self.llm_service.generate(prompt)
+            answer = await self.llm_service.generate(prompt)
             
-            # 7. Save assistant message
-            assistant_message = Message(
-                conversation_id=conversation.id,
-                role="assistant",
-                content=answer
+            # 6-10. Save the exchange and format citations
+            result = await asyncio.to_thread(
+                self._record_answer,
+                message, answer, conversation, retrieved_chunks, session
             )
-            session.add(assistant_message)
-            
-            # 8. Update conversation timestamp
-            from datetime import datetime
-            conversation.updated_at = datetime.utcnow()
-            session.add(conversation)
-            
-            session.commit()
-            logger.debug(f"Saved assistant message: {answer[:100]}...")
-            
-            # 9. Format citations
-            all_citations = self._format_citations(retrieved_chunks)
             
-            # 10. Filter citations to only those referenced in the answer
-            citations = self._filter_cited_sources(answer, all_citations)
-            
-            # 11. Return response
-            result = {
-                "conversation_id": conversation.id,
-                "answer": answer,
-                "citations": citations
-            }
-            
-            logger.info(f"RAG query completed successfully")
+            logger.info("RAG query completed successfully")
             return result
         
         except Exception as e:
-            logger.error(f"Failed to process RAG query: {e}")
+            logger.error("Failed to process RAG query: %s", e)
             raise
     
+    def _prepare_query(
+        self,
+        message: str,
+        conversation_id: Optional[int],
+        session: Session,
+        top_k: int
+    ) -> Tuple[Optional[Conversation], RetrievedBatch, str]:
+        """Look up the conversation, retrieve context and build the prompt."""
+        # 1. Look up existing conversation
+        conversation = None
+        if conversation_id:
+            conversation = self._get_conversation(conversation_id, session)
+            if not conversation:
+                logger.warning("Conversation %s not found, creating new", conversation_id)
+        
+        # 2. Get conversation history
+        history_messages = []
+        if conversation:
+            logger.info("Using conversation ID: %d", conversation.id)
+            history_messages = self._get_conversation_history(
+                conversation.id,
+                session,
+                limit=CONVERSATION_HISTORY_LENGTH
+            )
+        
+        # 3. Retrieve relevant chunks
+        logger.info("Retrieving top %d relevant chunks", top_k)
+        retrieved_chunks = self._retrieve_chunks(message, top_k)
+        
+        logger.info("Retrieved %d chunks", len(retrieved_chunks))
+        
+        # 4. Build RAG prompt
+        prompt = self._build_rag_prompt(
+            user_message=message,
+            history_messages=history_messages,
+            retrieved_chunks=retrieved_chunks
+        )
+        
+        logger.debug("Built prompt of length %d", len(prompt))
+        return conversation, retrieved_chunks, prompt
+    
+    def _record_answer(
+        self,
+        message: str,
+        answer: str,
+        conversation: Optional[Conversation],
+        retrieved_chunks: RetrievedBatch,
+        session: Session
+    ) -> Dict[str, Any]:
+        """Save the user/assistant exchange and build the response dict."""
+        # 6. Save conversation and messages. Writes are deferred until after
+        # generation so the caller's transaction doesn't hold the SQLite
+        # write lock during the LLM call.
+        if not conversation:
+            conversation = self._create_conversation(session, message)
+        
+        session.add(Message(
+            conversation_id=conversation.id,
+            role="user",
+            content=message
+        ))
+        session.add(Message(
+            conversation_id=conversation.id,
+            role="assistant",
+            content=answer
+        ))
+        
+        # 7. Update conversation timestamp; the database clock, like the
+        # column defaults, rather than naive UTC from Python
+        conversation.updated_at = func.now()
+        
+        # Send the writes here, in the worker thread (autoflush is off), so a
+        # busy SQLite lock never blocks the event loop; the caller commits
+        session.flush()
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Saved assistant message: %s...", answer[:100])
+        
+        # 8. Format citations
+        all_citations = self._format_citations(retrieved_chunks)
+        
+        # 9. Filter citations to only those referenced in the answer
+        citations = self._filter_cited_sources(answer, all_citations)
+        
+        # 10. Return response
+        return {
+            "conversation_id": conversation.id,
+            "answer": answer,
+            "citations": citations
+        }
+    
     def _create_conversation(self, session: Session, first_message: str = None) -> Conversation:
         """
         Create a new conversation.
@@ -145,10 +321,9 @@ class RAGService:
         
         conversation = Conversation(title=title)
         session.add(conversation)
-        session.commit()
-        session.refresh(conversation)
+        session.flush()  # Assigns the ID; committed by the caller
         
-        logger.info(f"Created new conversation with ID: {conversation.id}")
+        logger.info("Created new conversation with ID: %d", conversation.id)
         return conversation
     
     def _get_conversation(
@@ -184,21 +359,25 @@ class RAGService:
         Returns:
             List of Message objects (oldest first)
         """
-        statement = (
+        # Take the newest `limit` messages, then let SQLite return them in
+        # chronological order (served by ix_messages_conv_created)
+        recent = (
             select(Message)
             .where(Message.conversation_id == conversation_id)
-            .order_by(Message.created_at.desc())
+            .order_by(Message.created_at.desc(), Message.id.desc())
             .limit(limit)
+            .subquery()
+        )
+        recent_message = aliased(Message, recent)
+        statement = select(recent_message).order_by(
+            recent_message.created_at, recent_message.id
         )
         messages = list(session.exec(statement))
         
-        # Reverse to get chronological order
-        messages.reverse()
-        
-        logger.debug(f"Retrieved {len(messages)} history messages")
+        logger.debug("Retrieved %d history messages", len(messages))
         return messages
     
-    def _retrieve_chunks(self, query: str, top_k: int) -> List[Dict[str, Any]]:
+    def _retrieve_chunks(self, query: str, top_k: int) -> RetrievedBatch:
         """
         Retrieve relevant chunks from ChromaDB.
         
@@ -207,42 +386,79 @@ class RAGService:
             top_k: Number of chunks to retrieve
             
         Returns:
-            List of chunk dictionaries with metadata
+            RetrievedBatch of chunk contents, metadata and distances
         """
         try:
             # Generate query embedding
-            query_embedding = self.llm_service.embed_text(query)
-            
-            # Query ChromaDB
-            results = self.collection.query(
-                query_embeddings=[query_embedding],
-                n_results=top_k,
-                include=["documents", "metadatas", "distances"]
-            )
+            query_embedding = self._embed_query(query)
+            if not query_embedding.size:
+                return RetrievedBatch()
             
-            # Format results
-            chunks = []
+            # Query ChromaDB, batched with concurrent requests when enabled
+            if self._query_batcher:
+                results = self._query_batcher.query(query_embedding, top_k)
+            else:
+                results = self.collection.query(
+                    query_embeddings=query_embedding[None, :].tolist(),
+                    n_results=top_k,
+                    include=_QUERY_INCLUDE
+                )
+            
+            # Take the single query's rows as-is; no per-hit dicts
+            chunks = RetrievedBatch()
             if results and results['ids'] and results['ids'][0]:
-                for i in range(len(results['ids'][0])):
-                    chunk = {
-                        'content': results['documents'][0][i],
-                        'metadata': results['metadatas'][0][i],
-                        'distance': results['distances'][0][i] if 'distances' in results else None
-                    }
-                    chunks.append(chunk)
+                chunks.contents = results['documents'][0]
+                chunks.metadatas = results['metadatas'][0]
+                distances = results.get('distances')
+                chunks.distances = distances[0] if distances else [None] * len(chunks.contents)
             
-            logger.info(f"Retrieved {len(chunks)} chunks from ChromaDB")
+            logger.info("Retrieved %d chunks from ChromaDB", len(chunks))
             return chunks
         
         except Exception as e:
-            logger.error(f"Failed to retrieve chunks: {e}")
-            return []
+            logger.error("Failed to retrieve chunks: %s", e)
+            return RetrievedBatch()
+    
+    def _embed_query(self, query: str) -> np.ndarray:
+        """
+        Embed a query, reusing cached embeddings for repeated queries.
+        
+        The embedding model is uncased, so case and surrounding whitespace
+        variants share a cache entry.
+        
+        Args:
+            query: Search query
+            
+        Returns:
+            Query embedding
+        """
+        if QUERY_EMBEDDING_CACHE_SIZE <= 0:
+            return self.llm_service.embed_text(query)
+        
+        key = hashlib.blake2b(
+            query.strip().lower().encode(), digest_size=16
+        ).digest()
+        with self._embed_cache_lock:
+            embedding = self._embed_cache.get(key)
+            if embedding is not None:
+                self._embed_cache.move_to_end(key)
+                return embedding
+        
+        # Encode outside the lock; concurrent misses on one key just both encode
+        embedding = self.llm_service.embed_text(query)
+        if embedding.size:
+            with self._embed_cache_lock:
+                self._embed_cache[key] = embedding
+                self._embed_cache.move_to_end(key)
+                if len(self._embed_cache) > QUERY_EMBEDDING_CACHE_SIZE:
+                    self._embed_cache.popitem(last=False)
+        return embedding
     
     def _build_rag_prompt(
         self,
         user_message: str,
         history_messages: List[Message],
-        retrieved_chunks: List[Dict[str, Any]]
+        retrieved_chunks: RetrievedBatch
     ) -> str:
         """
         Build the RAG prompt with history and context.
@@ -255,65 +471,55 @@ class RAGService:
         Returns:
             Formatted prompt string
         """
+        buf = io.StringIO()
+        
         # System instruction
-        prompt_parts = [
-            "You are an AI assistant that answers strictly from company policy documents.",
-            "IMPORTANT: When answering, cite the sources you use by referencing their numbers (e.g., [1], [2]).",
-            "Only cite sources that directly support your answer.",
-            "If the answer is not in the context, say:",
-            '"I could not find this information in the provided company policies."',
-            ""
-        ]
+        buf.write(_PROMPT_PREAMBLE)
         
         # Conversation history
         if history_messages:
-            prompt_parts.append("Conversation history:")
+            buf.write("Conversation history:\n")
             for msg in history_messages:
                 role_label = "USER" if msg.role == "user" else "ASSISTANT"
-                prompt_parts.append(f"{role_label}: {msg.content}")
-            prompt_parts.append("")
+                buf.write(f"{role_label}: {msg.content}\n")
+            buf.write("\n")
         
         # Context chunks
-        prompt_parts.append("Context (each block labeled with the source document, section title, and line range):")
-        prompt_parts.append("")
+        buf.write("Context (each block labeled with the source document, section title, and line range):\n\n")
         
-        for idx, chunk in enumerate(retrieved_chunks, 1):
-            metadata = chunk['metadata']
+        for idx, (content, metadata) in enumerate(
+            zip(retrieved_chunks.contents, retrieved_chunks.metadatas), 1
+        ):
             doc_name = metadata.get('doc_name', 'unknown')
             section_title = metadata.get('section_title', '')
             start_line = metadata.get('start_line', 0)
             end_line = metadata.get('end_line', 0)
-            content = chunk['content']
             
-            prompt_parts.append(
+            buf.write(
                 f'[{idx}] (doc={doc_name}, section="{section_title}", '
-                f'lines={start_line}-{end_line})'
+                f'lines={start_line}-{end_line})\n'
             )
-            prompt_parts.append(content)
-            prompt_parts.append("")
+            buf.write(content)
+            buf.write("\n\n")
         
         # Current user query
-        prompt_parts.append(f"USER: {user_message}")
+        buf.write(f"USER: {user_message}")
         
-        prompt = "\n".join(prompt_parts)
-        return prompt
+        return buf.getvalue()
     
-    def _format_citations(self, chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    def _format_citations(self, chunks: RetrievedBatch) -> List[Dict[str, Any]]:
         """
         Format retrieved chunks as citations with readable snippets.
         
         Args:
-            chunks: Retrieved chunk dictionaries
+            chunks: Retrieved chunks
             
         Returns:
             List of citation dictionaries
         """
         citations = []
         
-        for chunk in chunks:
-            metadata = chunk['metadata']
-            content = chunk['content']
-            
+        for content, metadata in zip(chunks.contents, chunks.metadatas):
             # Create readable snippet starting from sentence boundary
             snippet = self._create_readable_snippet(content, max_length=250)
             
@@ -349,8 +555,7 @@ class RAGService:
         # If content starts mid-sentence, try to find the next sentence
         if content_stripped and not content_stripped[0].isupper():
             # Find the first period, question mark, or exclamation followed by space and capital
-            import re
-            match = re.search(r'[.!?]\s+([A-Z])', content_stripped)
+            match = _SENTENCE_START_RE.search(content_stripped)
             if match:
                 # Start from the capital letter after the punctuation
                 start_pos = match.start(1)
@@ -363,7 +568,6 @@ class RAGService:
         snippet = content_stripped[:max_length]
         
         # Try to end at the last complete sentence
-        import re
         last_sentence_end = max(
             snippet.rfind('. '),
             snippet.rfind('! '),
@@ -388,12 +592,8 @@ class RAGService:
         Returns:
             Filtered list of citations that were actually used
         """
-        import re
-        
         # Find all citation numbers in the answer like [1], [2], etc.
-        cited_numbers = set()
-        matches = re.findall(r'\[(\d+)\]', answer)
-        cited_numbers.update(int(num) for num in matches)
+        cited_numbers = {int(num) for num in _CITATION_RE.findall(answer)}
         
         # If no citations found in answer, return empty list (LLM didn't cite anything)
         if not cited_numbers:
@@ -407,7 +607,7 @@ class RAGService:
             if 0 <= idx < len(citations):
                 filtered.append(citations[idx])
         
-        logger.info(f"Filtered citations from {len(citations)} to {len(filtered)} based on answer")
+        logger.info("Filtered citations from %d to %d based on answer", len(citations), len(filtered))
         return filtered if filtered else citations  # Return all if filtering fails
     
     def get_conversation_messages(
@@ -426,7 +626,7 @@ class RAGService:
         statement = (
             select(Message)
             .where(Message.conversation_id == conversation_id)
-            .order_by(Message.created_at)
+            .order_by(Message.created_at, Message.id)
         )
         messages = list(session.exec(statement))
         
@@ -443,6 +643,7 @@ class RAGService:
 
 # Global singleton instance
 _rag_service_instance = None
+_rag_service_lock = threading.Lock()
 
 
 def get_rag_service() -> RAGService:
@@ -455,7 +656,9 @@ def get_rag_service() -> RAGService:
     global _rag_service_instance
     
     if _rag_service_instance is None:
-        logger.info("Initializing global RAGService")
-        _rag_service_instance = RAGService()
+        with _rag_service_lock:
+            if _rag_service_instance is None:
+                logger.info("Initializing global RAGService")
+                _rag_service_instance = RAGService()
     
     return _rag_service_instance
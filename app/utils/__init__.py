@@ -1,23 +1,34 @@
 """
 Utilities package initialization.
 """
-from app.utils.chunking import SemanticChunker, chunk_with_sections
-from app.utils.pdf_utils import extract_text, extract_text_from_pdf, extract_text_from_txt
+from app.utils.chunking import SemanticChunker, chunk_with_sections, iter_chunks_with_sections
+from app.utils.pdf_utils import (
+    extract_text,
+    extract_text_iter,
+    extract_text_from_pdf,
+    extract_text_from_txt,
+)
 from app.utils.text_utils import (
     detect_section_headings,
     clean_text,
     format_snippet,
     count_lines,
+    LineSplitter,
+    TextStats,
 )
 
 __all__ = [
     "SemanticChunker",
     "chunk_with_sections",
+    "iter_chunks_with_sections",
     "extract_text",
+    "extract_text_iter",
     "extract_text_from_pdf",
     "extract_text_from_txt",
     "detect_section_headings",
     "clean_text",
     "format_snippet",
     "count_lines",
+    "LineSplitter",
+    "TextStats",
 ]
@@ -1,9 +1,12 @@
 """
 Text chunking utility.
 """
-from typing import List, Tuple
-from app.config import CHUNK_SIZE, CHUNK_OVERLAP, SEPARATORS
+from bisect import bisect_left
+from typing import Iterable, Iterator, List, Tuple
+from app.config import CHUNK_SIZE, CHUNK_OVERLAP, SEPARATORS, SECTION_HEADING_RE
+from app.utils.text_utils import LineSplitter
 import logging
+import re
 
 logger = logging.getLogger(__name__)
 
@@ -23,107 +26,172 @@ class SemanticChunker:
     
     def chunk_text(self, text: str) -> List[Tuple[str, int, int]]:
         """Split text into chunks with line tracking."""
-        if not text or not text.strip():
-            return []
-        lines = text.splitlines()
-        total_lines = len(lines)
-        logger.debug(f"Chunking text with {total_lines} lines")
-        chunks = []
+        return list(self.iter_chunks((text,)))
+    
+    def iter_chunks(self, parts: Iterable[str]) -> Iterator[Tuple[str, int, int]]:
+        """
+        Split streamed text into chunks with line tracking.
+        
+        The parts concatenate to the full text (e.g. PDF pages as they are
+        extracted). Each chunk is yielded as soon as enough text has arrived
+        to fix its split point, so the output matches chunk_text on the
+        joined text.
+        """
+        # Text needed past a chunk start before its split point is final
+        lookahead = self.chunk_size + max(map(len, self.separators), default=0)
+        # Only text from the next chunk start on is buffered; earlier text
+        # is dropped as chunks are emitted, so memory stays near chunk_size
+        text = ""
+        # Offsets of every "\n" in text, so line lookups are a bisect
+        newlines: List[int] = []
+        # Lines wholly before the buffer
+        line_base = 0
+        has_content = False
         current_position = 0
-        iteration_count = 0
-        max_iterations = len(text) * 2  # Safety limit
-        while current_position < len(text) and iteration_count < max_iterations:
-            iteration_count += 1
-            
-            # Calculate chunk end position
-            chunk_end = min(current_position + self.chunk_size, len(text))
-            
-            # Extract chunk with potential extension to chunk_size
-            chunk_text = text[current_position:chunk_end]
-            
-            # If not at end, try to find a good split point
-            if chunk_end < len(text):
-                chunk_text = self._find_split_point(
-                    text[current_position:],
-                    self.chunk_size
+        chunk_count = 0
+        for part in parts:
+            idx = part.find("\n")
+            while idx != -1:
+                newlines.append(len(text) + idx)
+                idx = part.find("\n", idx + 1)
+            text += part
+            has_content = has_content or bool(part.strip())
+            # Whitespace-only text yields no chunks, so hold off until it can't be
+            if not has_content:
+                continue
+            while len(text) - current_position > lookahead:
+                chunk, current_position = self._next_chunk(
+                    text, newlines, current_position, line_base
                 )
-            
-            # Calculate line numbers for this chunk
-            start_line, end_line = self._get_line_numbers(
-                text, current_position, current_position + len(chunk_text)
-            )
-            
-            # Store original length before stripping
-            original_chunk_length = len(chunk_text)
-            
-            chunks.append((chunk_text.strip(), start_line, end_line))
-            
-            # Move to next chunk with overlap (use original length)
-            progress = max(1, original_chunk_length - self.chunk_overlap)
-            current_position += progress
-            
-            # Debug: ensure we're making forward progress
-            if progress <= 0:
-                logger.warning(f"Zero progress detected at position {current_position}, forcing +1")
-                current_position += 1
+                chunk_count += 1
+                yield chunk
+            if current_position:
+                dropped = bisect_left(newlines, current_position)
+                line_base += dropped
+                newlines = [offset - current_position for offset in newlines[dropped:]]
+                text = text[current_position:]
+                current_position = 0
+        
+        if has_content:
+            while current_position < len(text):
+                chunk, current_position = self._next_chunk(
+                    text, newlines, current_position, line_base
+                )
+                chunk_count += 1
+                yield chunk
         
-        if iteration_count >= max_iterations:
-            logger.warning(f"Chunking hit max iterations ({max_iterations}), stopping early")
+        # Line count from the newline offsets rather than materializing splitlines()
+        line_count = line_base + len(newlines) + (not text.endswith("\n")) if text else 0
+        logger.info(f"Created {chunk_count} chunks from {line_count} lines")
+    
+    def _next_chunk(
+        self, text: str, newlines: List[int], current_position: int, line_base: int = 0
+    ) -> Tuple[Tuple[str, int, int], int]:
+        """Cut the chunk starting at current_position; return it and the next start."""
+        # Find the chunk end, preferring a separator when not at the end of
+        # the text (_find_split_point returns the text end itself if it's near)
+        chunk_end = self._find_split_point(text, current_position, self.chunk_size)
+        
+        # Calculate line numbers for this chunk
+        start_line, end_line = self._get_line_numbers(newlines, current_position, chunk_end)
         
-        logger.info(f"Created {len(chunks)} chunks from {total_lines} lines")
-        return chunks
+        # Move to next chunk with overlap (use length before stripping)
+        progress = max(1, chunk_end - current_position - self.chunk_overlap)
+        return (
+            (
+                text[current_position:chunk_end].strip(),
+                line_base + start_line,
+                line_base + end_line
+            ),
+            current_position + progress
+        )
     
-    def _find_split_point(self, text: str, max_length: int) -> str:
+    def _find_split_point(self, text: str, start: int, max_length: int) -> int:
         """
         Find the best split point using separator priority.
         
         Args:
-            text: Text to split
+            text: Full text
+            start: Offset where the chunk begins
             max_length: Maximum length for the chunk
             
         Returns:
-            The chunk text up to the best split point
+            Offset just past the best split point
         """
-        if len(text) <= max_length:
-            return text
+        if len(text) - start <= max_length:
+            return len(text)
         
-        # Try each separator in priority order
+        # Try each separator in priority order. The first hit wins, so the
+        # usual case (a paragraph break in the window) is one C-level rfind;
+        # a multi-pattern automaton would instead surface every lower-priority
+        # match (each space) to Python and is far slower here
         for separator in self.separators:
-            # Find the last occurrence of separator before max_length
-            search_text = text[:max_length + len(separator)]
-            last_sep_idx = search_text.rfind(separator)
+            # Find the last occurrence of separator before max_length,
+            # searching in place instead of slicing the remaining text
+            last_sep_idx = text.rfind(separator, start, start + max_length + len(separator))
             
-            if last_sep_idx != -1 and last_sep_idx > 0:
+            if last_sep_idx > start:
                 # Found a good split point
-                return text[:last_sep_idx + len(separator)]
+                return last_sep_idx + len(separator)
         
         # No separator found, hard split at max_length
         logger.debug(f"Hard split at {max_length} characters")
-        return text[:max_length]
+        return start + max_length
     
     def _get_line_numbers(
-        self, full_text: str, start_pos: int, end_pos: int
+        self, newlines: List[int], start_pos: int, end_pos: int
     ) -> Tuple[int, int]:
         """
         Calculate line numbers for a character range.
         
         Args:
-            full_text: The complete text
+            newlines: Sorted offsets of every newline in the text
             start_pos: Starting character position
             end_pos: Ending character position
             
         Returns:
             Tuple of (start_line, end_line) - 1-indexed
         """
-        # Count newlines before start_pos
-        start_line = full_text[:start_pos].count('\n') + 1
-        
-        # Count newlines between start_pos and end_pos
-        end_line = full_text[:end_pos].count('\n') + 1
+        # Newlines before a position = insertion point among the offsets
+        start_line = bisect_left(newlines, start_pos) + 1
+        end_line = bisect_left(newlines, end_pos) + 1
         
         return start_line, end_line
 
 
+class _LineTracker:
+    """
+    Splits streamed text parts into lines as text.splitlines() would.
+    
+    Only lines not yet taken are held, so memory stays bounded while a
+    long document streams through.
+    """
+    
+    def __init__(self):
+        self.lines: List[str] = []
+        # Line number of lines[0]
+        self.first_line = 1
+        self._splitter = LineSplitter()
+    
+    def feed(self, part: str) -> None:
+        self.lines.extend(
+            segment.splitlines()[0] for segment in self._splitter.feed(part)
+        )
+    
+    def close(self) -> None:
+        self.lines.extend(self._splitter.close())
+    
+    def take_before(self, line_num: int) -> List[str]:
+        """Remove and return the complete lines numbered below line_num."""
+        count = min(line_num - self.first_line, len(self.lines))
+        if count <= 0:
+            return []
+        taken = self.lines[:count]
+        del self.lines[:count]
+        self.first_line += count
+        return taken
+
+
 def chunk_with_sections(
     text: str,
     section_pattern: str = None,
@@ -140,31 +208,42 @@ def chunk_with_sections(
     Returns:
         List of tuples: (chunk_text, start_line, end_line, section_title)
     """
-    import re
-    from app.config import SECTION_HEADING_PATTERN
+    return list(iter_chunks_with_sections((text,), section_pattern, chunk_size))
+
+
+def iter_chunks_with_sections(
+    parts: Iterable[str],
+    section_pattern: str = None,
+    chunk_size: int = CHUNK_SIZE
+) -> Iterator[Tuple[str, int, int, str]]:
+    """
+    Streaming chunk_with_sections over text parts that concatenate to the full text.
     
-    pattern = section_pattern or SECTION_HEADING_PATTERN
+    Args:
+        parts: Text pieces in order (e.g. extracted PDF pages)
+        section_pattern: Regex pattern for section headings
+        chunk_size: Target chunk size
+        
+    Yields:
+        Tuples: (chunk_text, start_line, end_line, section_title)
+    """
+    pattern = re.compile(section_pattern) if section_pattern else SECTION_HEADING_RE
     chunker = SemanticChunker(chunk_size=chunk_size)
+    tracker = _LineTracker()
     
-    # Get base chunks
-    base_chunks = chunker.chunk_text(text)
+    def tracked_parts() -> Iterator[str]:
+        for part in parts:
+            tracker.feed(part)
+            yield part
+        tracker.close()
     
-    # Add section information
-    lines = text.splitlines()
-    chunks_with_sections = []
-    
-    for chunk_text, start_line, end_line in base_chunks:
-        # Find the most recent section heading before this chunk
-        section_title = ""
-        for line_num in range(start_line - 1, 0, -1):
-            if line_num <= len(lines):
-                line = lines[line_num - 1]
-                if re.match(pattern, line.strip()):
-                    section_title = line.strip()
-                    break
+    # Lines before a chunk's start are always complete when it is yielded.
+    # Chunk start lines never decrease, so each line is checked for a heading
+    # once and the most recent heading so far is the chunk's section
+    section_title = ""
+    for chunk_text, start_line, end_line in chunker.iter_chunks(tracked_parts()):
+        for line in tracker.take_before(start_line):
+            if pattern.match(line.strip()):
+                section_title = line.strip()
         
-        chunks_with_sections.append((
-            chunk_text, start_line, end_line, section_title
-        ))
-    
-    return chunks_with_sections
+        yield chunk_text, start_line, end_line, section_title
@@ -2,38 +2,187 @@
 PDF text extraction utilities.
 """
 import pdfplumber
+from pdfminer.pdftypes import resolve1
+from pdfminer.psparser import LIT
 from pathlib import Path
-from typing import Optional
+from typing import Iterable, Iterator, List, Optional
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import repeat
+import codecs
 import logging
+import mmap
+import multiprocessing
+import os
+import threading
+
+from app.config import (
+    PDF_BACKEND,
+    PDF_EXTRACT_WORKERS,
+    PDF_PARALLEL_MIN_PAGES,
+    PDF_PAGES_PER_TASK,
+    UPLOAD_CHUNK_SIZE
+)
+
+try:
+    import pymupdf
+except ImportError:
+    pymupdf = None
 
 logger = logging.getLogger(__name__)
 
+if PDF_BACKEND == "pymupdf" and pymupdf is None:
+    logger.warning("PDF_BACKEND=pymupdf but PyMuPDF is not installed; using pdfplumber")
+# pdfplumber stays available for layout-sensitive callers via PDF_BACKEND=pdfplumber
+_USE_PYMUPDF = pymupdf is not None and PDF_BACKEND in ("auto", "pymupdf")
+# Backend actually in use; the two can differ in whitespace and line breaks
+EFFECTIVE_PDF_BACKEND = "pymupdf" if _USE_PYMUPDF else "pdfplumber"
 
-def extract_text_from_pdf(pdf_path: Path) -> Optional[str]:
-    """Extract text from a PDF file."""
-    try:
-        logger.info(f"Extracting text from PDF: {pdf_path.name}")
-        
-        text_content = []
-        
-        with pdfplumber.open(pdf_path) as pdf:
-            total_pages = len(pdf.pages)
-            logger.debug(f"PDF has {total_pages} pages")
-            
-            for page_num, page in enumerate(pdf.pages, 1):
-                page_text = page.extract_text()
-                
-                if page_text:
-                    text_content.append(page_text)
-                    logger.debug(f"Extracted {len(page_text)} chars from page {page_num}")
+_LITERAL_IMAGE = LIT("Image")
+
+# Lazily created pool for page extraction. Workers aren't forked from the
+# server process, whose model and database threads fork can't copy safely.
+# On POSIX they fork from a single-threaded forkserver that has imported only
+# this module; spawn (Windows) starts each worker from a fresh interpreter.
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+_pdf_pool_lock = threading.Lock()
+
+
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    global _pdf_pool
+    if _pdf_pool is None:
+        with _pdf_pool_lock:
+            if _pdf_pool is None:
+                if "forkserver" in multiprocessing.get_all_start_methods():
+                    mp_context = multiprocessing.get_context("forkserver")
+                    mp_context.set_forkserver_preload([__name__])
                 else:
-                    logger.warning(f"No text found on page {page_num}")
+                    mp_context = multiprocessing.get_context("spawn")
+                _pdf_pool = ProcessPoolExecutor(
+                    max_workers=PDF_EXTRACT_WORKERS,
+                    mp_context=mp_context
+                )
+    return _pdf_pool
+
+
+def _discard_pdf_pool(pool: ProcessPoolExecutor) -> None:
+    """Drop a pool whose worker died, so the next PDF starts a fresh one."""
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is pool:
+            _pdf_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _page_may_have_text(page: pdfplumber.page.Page) -> bool:
+    """
+    Check the page's resource dictionary for anything that can draw text.
+    
+    Pages without fonts or form XObjects (typically scans) can't contain
+    text, so their content and image streams never need to be decoded.
+    """
+    try:
+        resources = resolve1(page.page_obj.resources) or {}
+        if resolve1(resources.get("Font")):
+            return True
+        xobjects = resolve1(resources.get("XObject")) or {}
+        # Form XObjects carry their own fonts; only plain images are text-free
+        return any(
+            resolve1(resolve1(xobj).attrs.get("Subtype")) is not _LITERAL_IMAGE
+            for xobj in xobjects.values()
+        )
+    except Exception:
+        return True  # Unusual structure; let extract_text decide
+
+
+def _extract_page(page: pdfplumber.page.Page) -> Optional[str]:
+    if not _page_may_have_text(page):
+        logger.debug(f"Skipping image-only page {page.page_number}")
+        return None
+    try:
+        # Plain text-flow extraction; pinned so a pdfplumber upgrade can't
+        # switch on the slower layout-preserving mode
+        return page.extract_text(layout=False, x_tolerance=3, y_tolerance=3)
+    finally:
+        # The PDF object keeps every page, and each page caches its parsed
+        # layout and objects; drop them once the text is out
+        page.flush_cache()
+
+
+def _extract_page_range(pdf_path: Path, start: int, stop: int) -> List[Optional[str]]:
+    """Extract pages [start, stop) in a worker; pdfplumber handles can't be shared."""
+    # No LAParams: pdfminer's layout analysis isn't needed for extract_text
+    with pdfplumber.open(pdf_path, laparams=None) as pdf:
+        return [_extract_page(pdf.pages[i]) for i in range(start, stop)]
+
+
+def _iter_pymupdf_pages(pdf_path: Path) -> Iterator[str]:
+    """Yield page texts with PyMuPDF, which is several times faster than pdfminer."""
+    with pymupdf.open(pdf_path) as doc:
+        logger.debug(f"PDF has {doc.page_count} pages")
+        for page in doc:
+            # PyMuPDF ends every line with a newline; pdfplumber doesn't end the page with one
+            yield page.get_text("text").rstrip("\n")
+
+
+def iter_pdf_text(pdf_path: Path) -> Iterator[str]:
+    """Yield PDF text page by page; the pieces join to extract_text_from_pdf's result."""
+    logger.info(f"Extracting text from PDF: {pdf_path.name}")
+    
+    if _USE_PYMUPDF:
+        yield from _join_pages(_iter_pymupdf_pages(pdf_path))
+        return
+    
+    # No LAParams: pdfminer's layout analysis isn't needed for extract_text
+    with pdfplumber.open(pdf_path, laparams=None) as pdf:
+        total_pages = len(pdf.pages)
+        logger.debug(f"PDF has {total_pages} pages")
         
-        full_text = "\n".join(text_content)
-        logger.info(
-            f"Successfully extracted {len(full_text)} characters "
-            f"from {total_pages} pages"
+        if total_pages < PDF_PARALLEL_MIN_PAGES or PDF_EXTRACT_WORKERS <= 1:
+            yield from _join_pages(_extract_page(page) for page in pdf.pages)
+            return
+    
+    # Fan page ranges out to worker processes; map() keeps page order and
+    # yields each range as soon as it and all earlier ones are done
+    starts = range(0, total_pages, PDF_PAGES_PER_TASK)
+    pool = _get_pdf_pool()
+    try:
+        batches = pool.map(
+            _extract_page_range,
+            repeat(pdf_path),
+            starts,
+            (min(start + PDF_PAGES_PER_TASK, total_pages) for start in starts)
         )
+        yield from _join_pages(text for batch in batches for text in batch)
+    except BrokenProcessPool:
+        # A worker died (OOM kill, crash in a C extension) and the pool is
+        # unusable; replace it for later PDFs rather than retrying this one
+        # in the server process
+        logger.error(f"PDF extraction worker died while processing {pdf_path.name}")
+        _discard_pdf_pool(pool)
+        raise
+
+
+def _join_pages(page_texts: Iterable[Optional[str]]) -> Iterator[str]:
+    """Yield non-empty page texts with newline separators between them."""
+    first = True
+    for page_num, page_text in enumerate(page_texts, 1):
+        if page_text:
+            # Pages are newline-separated
+            if not first:
+                yield "\n"
+            first = False
+            logger.debug(f"Extracted {len(page_text)} chars from page {page_num}")
+            yield page_text
+        else:
+            logger.warning(f"No text found on page {page_num}")
+
+
+def extract_text_from_pdf(pdf_path: Path) -> Optional[str]:
+    """Extract text from a PDF file."""
+    try:
+        full_text = "".join(iter_pdf_text(pdf_path))
+        logger.info(f"Successfully extracted {len(full_text)} characters from {pdf_path.name}")
         
         return full_text
     
@@ -59,7 +208,13 @@ def extract_text_from_txt(txt_path: Path) -> Optional[str]:
         logger.info(f"Reading text file: {txt_path.name}")
         
         with open(txt_path, 'rb') as f:
-            content = f.read().decode('utf-8', errors='ignore')
+            if os.fstat(f.fileno()).st_size == 0:
+                content = ""  # mmap rejects empty files
+            else:
+                # Decode straight from the mapped pages instead of reading
+                # the whole file into an intermediate bytes object first
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    content = str(mm, 'utf-8', 'ignore')
         
         logger.info(f"Successfully read {len(content)} characters from {txt_path.name}")
         return content
@@ -69,6 +224,19 @@ def extract_text_from_txt(txt_path: Path) -> Optional[str]:
         raise
 
 
+def iter_txt_text(txt_path: Path) -> Iterator[str]:
+    """Yield a text file's content in blocks; the pieces join to extract_text_from_txt's result."""
+    logger.info(f"Reading text file: {txt_path.name}")
+    # The incremental decoder carries multi-byte sequences split across blocks
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+    with open(txt_path, 'rb') as f:
+        while block := f.read(UPLOAD_CHUNK_SIZE):
+            if text := decoder.decode(block):
+                yield text
+    if text := decoder.decode(b"", final=True):
+        yield text
+
+
 def extract_text(file_path: Path) -> str:
     """
     Extract text from a file (PDF or TXT).
@@ -91,3 +259,28 @@ def extract_text(file_path: Path) -> str:
         return extract_text_from_txt(file_path)
     else:
         raise ValueError(f"Unsupported file type: {suffix}")
+
+
+def extract_text_iter(file_path: Path) -> Iterator[str]:
+    """
+    Extract text from a file (PDF or TXT) incrementally.
+    
+    Args:
+        file_path: Path to the file
+        
+    Returns:
+        Iterator of text pieces that concatenate to extract_text's result;
+        PDFs are yielded page by page as they are parsed, text files in
+        fixed-size blocks
+        
+    Raises:
+        ValueError: If file type is not supported
+    """
+    suffix = file_path.suffix.lower()
+    
+    if suffix == '.pdf':
+        return iter_pdf_text(file_path)
+    elif suffix == '.txt':
+        return iter_txt_text(file_path)
+    else:
+        raise ValueError(f"Unsupported file type: {suffix}")
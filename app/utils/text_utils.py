@@ -2,20 +2,54 @@
 Text processing utilities.
 """
 import re
-from typing import List
-from app.config import SECTION_HEADING_PATTERN
+from functools import lru_cache
+from typing import List, Optional
+from app.config import SECTION_HEADING_RE
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+# Pattern features whose meaning changes when matched mid-text instead of
+# against a single stripped line
+_LINE_ANCHORED_RE = re.compile(r"\$|\^|\\[AZ]|\(\?")
+
+
+@lru_cache(maxsize=32)
+def _heading_scan_re(pattern: str, flags: int) -> Optional[re.Pattern]:
+    """
+    Build a multiline regex that finds candidate heading lines in joined text.
+    
+    Returns None if the pattern can't be safely lifted to a whole-text scan.
+    """
+    body = pattern[1:] if pattern.startswith("^") else pattern
+    if _LINE_ANCHORED_RE.search(body):
+        return None
+    # Zero-width, so a candidate that spans lines can't hide the next one
+    return re.compile(rf"^(?=[^\S\n]*(?:{body}))", flags | re.MULTILINE)
+
+
 def detect_section_headings(lines: List[str], pattern: str = None) -> List[tuple]:
     """Detect section headings in lines."""
-    pattern = pattern or SECTION_HEADING_PATTERN
+    heading_re = re.compile(pattern) if pattern else SECTION_HEADING_RE
+    scan_re = _heading_scan_re(heading_re.pattern, heading_re.flags)
     headings = []
-    for i, line in enumerate(lines, 1):
-        if re.match(pattern, line.strip()):
-            headings.append((i, line.strip()))
+    if scan_re is None:
+        for i, line in enumerate(map(str.strip, lines), 1):
+            if heading_re.match(line):
+                headings.append((i, line))
+    else:
+        # One regex sweep over the joined text finds candidate lines; each is
+        # confirmed with the per-line match so results are unchanged
+        text = "\n".join(lines)
+        line_num = 1
+        pos = 0
+        for m in scan_re.finditer(text):
+            line_num += text.count("\n", pos, m.start())
+            pos = m.start()
+            line = lines[line_num - 1].strip()
+            if heading_re.match(line):
+                headings.append((line_num, line))
     logger.debug(f"Found {len(headings)} section headings")
     return headings
 
@@ -24,13 +58,27 @@ def clean_text(text: str) -> str:
     """Clean and normalize text."""
     if not text:
         return ""
-    text = re.sub(r'\s+', ' ', text)
-    text = text.strip()
-    return text
+    # Already-normalized text is returned as is: every whitespace character
+    # other than " " is non-printable, so passing these checks leaves only
+    # single inner spaces
+    if (
+        not text[0].isspace()
+        and not text[-1].isspace()
+        and text.isprintable()
+        and "  " not in text
+    ):
+        return text
+    # str.split() uses the same whitespace set as re's \s and drops the ends,
+    # so this matches re.sub(r'\s+', ' ', text).strip() without the regex engine
+    return ' '.join(text.split())
 
 
 def format_snippet(text: str, max_length: int = 200) -> str:
-    """Create a display snippet from text."""
+    """
+    Create a display snippet from text.
+    
+    Args:
+        text: Input text
         max_length: Maximum snippet length
         
     Returns:
@@ -39,8 +87,16 @@ def format_snippet(text: str, max_length: int = 200) -> str:
     if len(text) <= max_length:
         return text
     
-    snippet = text[:max_length].rsplit(' ', 1)[0]
-    return snippet + "..."
+    # Cut at the last space inside the window, or hard-truncate if there is none
+    cut = text.rfind(' ', 0, max_length)
+    if cut == -1:
+        cut = max_length
+    return text[:cut] + "..."
+
+
+# Line boundaries str.splitlines() recognizes besides "\n" ("\r\n" included
+# via "\r")
+_OTHER_LINE_BREAKS = "\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029"
 
 
 def count_lines(text: str) -> int:
@@ -55,4 +111,59 @@ def count_lines(text: str) -> int:
     """
     if not text:
         return 0
-    return len(text.splitlines())
+    # With "\n" as the only line break, counting newlines matches
+    # splitlines() without building the list; otherwise defer to it
+    if any(c in text for c in _OTHER_LINE_BREAKS):
+        return len(text.splitlines())
+    return text.count("\n") + (not text.endswith("\n"))
+
+
+class LineSplitter:
+    """
+    Splits streamed text parts into lines as splitlines() would the joined text.
+    
+    A part's last line is held back until a later part (or close()) shows
+    where it ends.
+    """
+    
+    def __init__(self):
+        self._pending = ""
+    
+    def feed(self, part: str) -> List[str]:
+        """Return the lines this part completes, line breaks included."""
+        segments = (self._pending + part).splitlines(keepends=True)
+        self._pending = ""
+        if segments:
+            last = segments[-1]
+            # An unterminated line, or a "\r" the next part may extend to "\r\n"
+            if last.endswith("\r") or last.splitlines()[0] == last:
+                self._pending = segments.pop()
+        return segments
+    
+    def close(self) -> List[str]:
+        """Return the held-back final line, if any, without its line break."""
+        pending, self._pending = self._pending, ""
+        return pending.splitlines()
+
+
+class TextStats:
+    """
+    Running character and line counts over streamed text parts.
+    
+    After close(), line_count equals count_lines() of the joined text, so
+    callers don't have to keep the whole document around to report it.
+    """
+    
+    def __init__(self):
+        self.character_count = 0
+        self.line_count = 0
+        self.has_content = False
+        self._splitter = LineSplitter()
+    
+    def feed(self, part: str) -> None:
+        self.character_count += len(part)
+        self.has_content = self.has_content or (bool(part) and not part.isspace())
+        self.line_count += len(self._splitter.feed(part))
+    
+    def close(self) -> None:
+        self.line_count += len(self._splitter.close())
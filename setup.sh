@@ -48,7 +48,7 @@ echo "Setup complete!"
 echo "========================================="
 echo ""
 echo "To start the server, run:"
-echo "  python app/main.py"
+echo "  python -m app"
 echo ""
 echo "Or with uvicorn:"
 echo "  uvicorn app.main:app --reload"
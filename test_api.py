@@ -3,18 +3,28 @@
 Test script for RAG chatbot setup and functionality.
 """
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 import json
 import sys
 from pathlib import Path
 
 BASE_URL = "http://localhost:8000"
 
+# One pooled session so every test reuses its TCP connection to the server
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_connections=10, pool_maxsize=10))
+SESSION.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=10))
+
+
+def format_section(title):
+    """Format a section header."""
+    return "\n" + "=" * 70 + f"\n  {title}\n" + "=" * 70
+
 
 def print_section(title):
     """Print a section header."""
-    print("\n" + "=" * 70)
-    print(f"  {title}")
-    print("=" * 70)
+    print(format_section(title))
 
 
 def test_health():
@@ -22,7 +32,7 @@ def test_health():
     print_section("Testing Health Endpoint")
     
     try:
-        response = requests.get(f"{BASE_URL}/health")
+        response = SESSION.get(f"{BASE_URL}/health")
         response.raise_for_status()
         
         data = response.json()
@@ -51,7 +61,7 @@ def test_upload_document():
     try:
         with open(sample_file, 'rb') as f:
             files = {'file': (sample_file.name, f, 'text/plain')}
-            response = requests.post(f"{BASE_URL}/docs/upload", files=files)
+            response = SESSION.post(f"{BASE_URL}/docs/upload", files=files)
             response.raise_for_status()
         
         data = response.json()
@@ -71,7 +81,8 @@ def test_upload_document():
 
 def test_chat_query(query):
     """Test chat query."""
-    print_section(f"Testing Chat Query: '{query}'")
+    # Queries run concurrently, so each report is printed in one piece
+    lines = [format_section(f"Testing Chat Query: '{query}'")]
     
     try:
         payload = {
@@ -79,7 +90,7 @@ def test_chat_query(query):
             "conversation_id": None
         }
         
-        response = requests.post(
+        response = SESSION.post(
             f"{BASE_URL}/chat/query",
             json=payload,
             headers={"Content-Type": "application/json"}
@@ -87,23 +98,26 @@ def test_chat_query(query):
         response.raise_for_status()
         
         data = response.json()
-        print(f"✅ Query successful!")
-        print(f"   Conversation ID: {data['conversation_id']}")
-        print(f"\n📝 Answer:")
-        print(f"   {data['answer']}")
-        print(f"\n📚 Citations ({len(data['citations'])}):")
+        lines.append(f"✅ Query successful!")
+        lines.append(f"   Conversation ID: {data['conversation_id']}")
+        lines.append(f"\n📝 Answer:")
+        lines.append(f"   {data['answer']}")
+        lines.append(f"\n📚 Citations ({len(data['citations'])}):")
         
         for i, citation in enumerate(data['citations'], 1):
-            print(f"\n   [{i}] {citation['doc_name']}")
-            print(f"       Section: {citation['section_title']}")
-            print(f"       Lines: {citation['start_line']}-{citation['end_line']}")
-            print(f"       Snippet: {citation['snippet'][:100]}...")
+            lines.append(f"\n   [{i}] {citation['doc_name']}")
+            lines.append(f"       Section: {citation['section_title']}")
+            lines.append(f"       Lines: {citation['start_line']}-{citation['end_line']}")
+            lines.append(f"       Snippet: {citation['snippet'][:100]}...")
         
         return data['conversation_id']
     
     except Exception as e:
-        print(f"❌ Chat query failed: {e}")
+        lines.append(f"❌ Chat query failed: {e}")
         return None
+    
+    finally:
+        print("\n".join(lines))
 
 
 def test_list_documents():
@@ -111,7 +125,7 @@ def test_list_documents():
     print_section("Testing List Documents")
     
     try:
-        response = requests.get(f"{BASE_URL}/docs/list")
+        response = SESSION.get(f"{BASE_URL}/docs/list")
         response.raise_for_status()
         
         data = response.json()
@@ -135,7 +149,7 @@ def main():
     print("  RAG Company Policy Chatbot - Test Suite")
     print("=" * 70)
     print(f"\nTesting API at: {BASE_URL}")
-    print("Make sure the server is running (python app/main.py)")
+    print("Make sure the server is running (python -m app)")
     
     input("\nPress Enter to start tests...")
     
@@ -160,9 +174,12 @@ def main():
         "What is the professional development budget?",
     ]
     
-    conversation_id = None
-    for query in test_queries:
-        conversation_id = test_chat_query(query)
+    # Each query starts a new conversation, so they can run side by side
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        conversation_ids = list(executor.map(test_chat_query, test_queries))
+    failed_queries = conversation_ids.count(None)
+    if failed_queries:
+        print(f"\n⚠️  {failed_queries} of {len(test_queries)} chat queries failed.")
     
     # Summary
     print_section("Test Summary")